@@ -1,116 +1,235 @@
-from copy import deepcopy
-from typing import Dict, List, Optional, Tuple
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
 
 import numpy as np
 
-from eoscsp import EOSCSP, Observation, Request, Satellite
+import instrument
+from eoscsp import EOSCSP, Observation, Request
 from greedy import first_slot, greedy_eoscsp_solver
+from intervals import SatelliteIntervalIndex
+from session import SolveSession
+from timeline import Timeline
 from utils import generate_random_esop_instance
 
 
-def bid(request: Request, R: Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]]) -> Optional[
-    Tuple[float, Tuple[Observation, float]]]:
-    # This function calculates the bid for a request based on the current plan
+def bid(request: Request, R: Dict[int, Timeline]) -> Optional[Tuple[float, Tuple[Observation, float]]]:
+    # This function calculates the bid for a request based on the current plan, the plan is not modified
     # The bid is a tuple of the form (bid_value, winning_observation)
     o_sorted = sorted(request.theta, key=lambda obs: obs.t_start)
     for o in o_sorted:
-        t = first_slot(o, R)
+        t = first_slot(o, R, probe=True)
         if t is not None:
             return o.rho, (o, t[1])
     return 0, (None, -1)
 
 
-def try_add(M, sig_u):
+class BidEngine:
+    """
+    Batched form of `bid` for a fixed list of requests: the bids of a plan on all the requests are computed at once with NumPy.
+    The opportunities of the requests are laid out once, ordered by request then by start time (the order in which `bid` tries
+    them), and grouped by satellite. For a plan, the gaps of each timeline are scanned for all the observations of the satellite
+    together, starting from the first gap that can fit each of them as in `Timeline.find_slot`, so that the bids and their
+    signatures are those of `bid`.
+    :param requests: The requests to bid on.
+    """
+    
+    def __init__(self, requests: List[Request]):
+        self.requests = requests
+        self.observations = [o for request in requests for o in sorted(request.theta, key=lambda obs: obs.t_start)]
+        self.request = np.array([i for i, request in enumerate(requests) for _ in request.theta], dtype=int)
+        self.t_start = np.array([o.t_start for o in self.observations], dtype=float)
+        self.t_end = np.array([o.t_end for o in self.observations], dtype=float)
+        self.delta = np.array([o.delta for o in self.observations], dtype=float)
+        satellite = np.array([o.s.id for o in self.observations], dtype=int)
+        self.by_satellite = {int(satid): np.flatnonzero(satellite == satid) for satid in np.unique(satellite)}
+    
+    def slots(self, R: Dict[int, Timeline]) -> np.ndarray:
+        # start time of the earliest slot of each observation in the plan R, NaN if it does not fit
+        start = np.full(len(self.observations), np.nan)
+        for satid, rows in self.by_satellite.items():
+            timeline = R[satid]
+            s = timeline.satellite
+            n = len(timeline)
+            if n >= s.capacity:
+                continue
+            t_start, t_end, delta = self.t_start[rows], self.t_end[rows], self.delta[rows]
+            if n == 0:
+                fits = t_end >= t_start + delta
+                start[rows[fits]] = t_start[fits]
+                continue
+            starts = np.array(timeline.starts)
+            free_after = np.array(timeline.free_after)
+            gap = np.searchsorted(starts, t_start + delta + s.transition_time, side='left')
+            last = np.minimum(n, np.searchsorted(starts, t_end, side='right'))
+            active = np.flatnonzero(gap <= last)
+            while len(active):
+                i = gap[active]
+                t_start_prime = t_start[active]
+                after = i > 0
+                t_start_prime[after] = np.maximum(t_start_prime[after], free_after[i[after] - 1])
+                end = i == n
+                t_upper = np.where(end, t_end[active], starts[np.minimum(i, n - 1)])
+                t_end_prime = np.where(end, t_start_prime + delta[active], t_start_prime + delta[active] + s.transition_time)
+                fits = (t_start_prime + delta[active] <= t_end[active]) & (t_start_prime < t_end_prime) & (t_end_prime <= t_upper)
+                start[rows[active[fits]]] = t_start_prime[fits]
+                active = active[~fits]
+                gap[active] += 1
+                active = active[gap[active] <= last[active]]
+        return start
+    
+    def bids(self, R: Dict[int, Timeline]) -> Tuple[np.ndarray, List[Tuple[Observation, float]]]:
+        """
+        The bids of the plan R on the requests, R is not modified.
+        :return: The bid values, and the signature (winning observation, start time) of each bid, (None, -1) for a zero bid.
+        """
+        start = self.slots(R)
+        values = np.zeros(len(self.requests))
+        signatures = [(None, -1)] * len(self.requests)
+        feasible = np.flatnonzero(~np.isnan(start))
+        # the first feasible opportunity of each request
+        requests, first = np.unique(self.request[feasible], return_index=True)
+        for i, row in zip(requests, feasible[first]):
+            o = self.observations[row]
+            values[i] = o.rho
+            signatures[i] = (o, float(start[row]))
+        return values, signatures
+
+
+def try_add(M: SatelliteIntervalIndex, sig_u):
     # Attempt to add a new observation to the plan
     new_obs, new_start = sig_u
-    idx = []
+    overlapping = []
     removed = []
     reward = 0
     
-    for i, (o, (s, start)) in enumerate(M):
-        if o.s != new_obs.s:
-            continue
+    for entry in M.overlapping(new_obs.s.id, new_start, new_start + new_obs.delta):
+        overlapping.append(entry)
+        reward += entry[1].rho
         
-        if (start <= new_start <= start + o.delta) or (new_start <= start <= new_start + new_obs.delta):
-            idx.append(i)
-            reward += o.rho
-            
-            if reward >= new_obs.rho:
-                return False, []
-            
-            if len(idx) == 2:
-                break
+        if reward >= new_obs.rho:
+            return False, []
+        
+        if len(overlapping) == 2:
+            break
     
-    for i in reversed(idx):
-        removed.append(M[i][0].request.id)
-        M.pop(i)
+    for entry in reversed(overlapping):
+        removed.append(entry[1].request.id)
+        M.remove(entry)
     
     return True, removed
 
 
-def psi_solver(p: EOSCSP):
+class BidCache:
+    """
+    Bids of the exclusive users on the non-exclusive requests of a sequential auction, keyed by (user id, request id).
+    A bid only depends on the timelines of the bidder on the satellites of the request, so when a user commits an observation only
+    its bids on the pending requests with an opportunity on that satellite are invalidated, the other bids are reused.
+    :param requests: The requests to auction.
+    :param R: The plans of the bidders, by user id.
+    """
+    
+    def __init__(self, requests: List[Request], R: Dict[int, Dict[int, Timeline]]):
+        self.R = R
+        self.bids: Dict[Tuple[int, int], Tuple[float, Tuple[Observation, float]]] = {}
+        # pending request ids with an opportunity on each satellite
+        self.pending: Dict[int, Set[int]] = defaultdict(set)
+        for request in requests:
+            for o in request.theta:
+                self.pending[o.s.id].add(request.id)
+    
+    def get(self, userid: int, request: Request) -> Tuple[float, Tuple[Observation, float]]:
+        key = (userid, request.id)
+        if key not in self.bids:
+            instrument.count('ssi.bids')
+            self.bids[key] = bid(request, self.R[userid])
+        return self.bids[key]
+    
+    def fill(self, requests: List[Request]):
+        # bid of every user on every request before the auction, computed in batch
+        engine = BidEngine(requests)
+        for userid, plan in self.R.items():
+            values, signatures = engine.bids(plan)
+            instrument.count('ssi.bids', len(requests))
+            for request, value, signature in zip(requests, values, signatures):
+                self.bids[(userid, request.id)] = (float(value), signature)
+    
+    def done(self, request: Request):
+        # the request has been auctioned, its bids are not needed anymore
+        for o in request.theta:
+            self.pending[o.s.id].discard(request.id)
+        for userid in self.R:
+            self.bids.pop((userid, request.id), None)
+    
+    def invalidate(self, userid: int, satid: int):
+        # the timeline of a user on a satellite changed
+        for reqid in self.pending[satid]:
+            self.bids.pop((userid, reqid), None)
+
+
+def psi_solver(p: EOSCSP, workers: int = 1, session: SolveSession = None):
     """
     PSI Solver for the EOSCSP.
     :param p: An instance of EOSCSP.
+    :param workers: The number of processes solving the exclusive users' sub problems, see solve_exclusive_users.
+    :param session: A SolveSession of p, to reuse the exclusive users' plans computed by another solver.
     :return: A mapping from each observation to (satellite, start_time).
     """
-    plans = []
+    session = session or SolveSession(p, workers)
+    plans = SatelliteIntervalIndex(p.satellites)
     
     # Non-exclusive requests sorted by end time
-    not_exclusive_requests = [r for r in p.requests if not r.u.exclusive_times]
-    not_exclusive_requests.sort(key=lambda r: r.t_end)
+    not_exclusive_requests = session.non_exclusive_requests()
     
     B_u = []  # List to store bids
     sig_u = []  # List to store signatures (plans) corresponding to each bid
     
     # Iterate over exclusive users and calculate bids for non-exclusive requests
-    for user in p.users:
-        if user.exclusive_times:
-            sub_p = EOSCSP(satellites=p.satellites, users=[user], requests=[r for r in p.requests if r.u == user],
-                           observations=[o for o in p.observations if o.u == user])
-            _, r,_ = greedy_eoscsp_solver(sub_p)
-            
-            plans.extend([x for value in r.values() for x in value])
-            
-            bids = [bid(req, deepcopy(r)) for req in not_exclusive_requests]
-            B_u.append([b[0] for b in bids if b])
-            sig_u.append([b[1] for b in bids if b])
-    
-    max_bid = np.max(B_u, axis=0)
-    b_t = np.transpose(B_u)
-    processed_requests = set()
-    
-    # Determine winning bids and update plans
-    for i, req in enumerate(not_exclusive_requests):
-        if max_bid[i] <= 0:
-            continue
-        w = np.where(b_t[i] == max_bid[i])[0][0]
+    with instrument.phase('psi.bids'):
+        user_plans = session.user_plans()
+        engine = BidEngine(not_exclusive_requests)
+        for user in p.users:
+            if user.exclusive_times:
+                _, r, _ = user_plans[user.id]
+                
+                plans.extend(x for value in r.values() for x in value)
+                
+                bids, signatures = engine.bids(r)
+                B_u.append(bids)
+                sig_u.append(signatures)
+    
+    with instrument.phase('psi.merge'):
+        max_bid = np.max(B_u, axis=0)
+        b_t = np.transpose(B_u)
+        processed_requests = set()
         
-        added, removed = try_add(plans, sig_u[w][i])
-        if added:
-            sat = sig_u[w][i][0].s
-            plans.append((sig_u[w][i][0], (sat, sig_u[w][i][1])))
-            processed_requests.add(req.id)
-            for r_id in removed:
-                if r_id in processed_requests:
-                    processed_requests.remove(r_id)
-    
-    # Sort plans for execution order
-    plans.sort(key=lambda x: (x[1][1]))
-    R_ex = {sat.id: [] for sat in p.satellites}
-    for obs, (start, end) in plans:
-        R_ex[obs.s.id].append((obs, (start, end)))
-    
-    # Schedule remaining non-exclusive requests
-    remaining_requests = [req for req in not_exclusive_requests if req.id not in processed_requests]
-    obs = [obs for req in remaining_requests for obs in req.theta]
-    p_u0 = EOSCSP(satellites=p.satellites, users=[p.users[0]], requests=remaining_requests, observations=obs)
-    _, r,_ = greedy_eoscsp_solver(p_u0, R_ex)
+        # Determine winning bids and update plans
+        for i, req in enumerate(not_exclusive_requests):
+            if max_bid[i] <= 0:
+                continue
+            w = np.where(b_t[i] == max_bid[i])[0][0]
+            
+            added, removed = try_add(plans, sig_u[w][i])
+            if added:
+                plans.add(sig_u[w][i][0], sig_u[w][i][1])
+                processed_requests.add(req.id)
+                for r_id in removed:
+                    if r_id in processed_requests:
+                        processed_requests.remove(r_id)
+    
+    # Plans of each satellite in execution order
+    R_ex = plans.plan()
+    
+    with instrument.phase('psi.p_u0'):
+        # Schedule remaining non-exclusive requests
+        remaining_requests = [req for req in not_exclusive_requests if req.id not in processed_requests]
+        obs = [obs for req in remaining_requests for obs in req.theta]
+        p_u0 = EOSCSP(satellites=p.satellites, users=[p.users[0]], requests=remaining_requests, observations=obs)
+        _, r,_ = greedy_eoscsp_solver(p_u0, R_ex)
     M = [x for value in r.values() for x in value]
     
     # Calculate total reward
     total_reward = sum([o.rho for o, _ in M])
-    print("Reward of psi: ", total_reward)
+    instrument.report('psi', total_reward)
     
     # convert to dictionary
     final_solution = {}
@@ -120,66 +239,77 @@ def psi_solver(p: EOSCSP):
     return final_solution,total_reward
 
 
-def ssi_solver(p: EOSCSP):
-    plans = []
+def ssi_solver(p: EOSCSP, workers: int = 1, session: SolveSession = None, seed: int = None):
+    """
+    Sequential single-item auction of the non-exclusive requests among the exclusive users.
+    :param seed: Seed of the random choice between equal bids, np.random is used when it is None.
+    """
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    session = session or SolveSession(p, workers)
+    plans = SatelliteIntervalIndex(p.satellites)
     
     # Non-exclusive requests sorted by end time
-    not_exclusive_requests = [r for r in p.requests if not r.u.exclusive_times]
-    not_exclusive_requests.sort(key=lambda r: r.t_end)
+    not_exclusive_requests = session.non_exclusive_requests()
     
     B_u = []  # List to store bids
     sig_u = []  # List to store signatures (plans) corresponding to each bid
     
     R_ex = {sat.id: None for sat in p.satellites}
     # Iterate over exclusive users and calculate bids for non-exclusive requests
+    user_plans = session.user_plans()
     for user in p.users:
         if user.exclusive_times:
-            sub_p = EOSCSP(satellites=p.satellites, users=[user], requests=[r for r in p.requests if r.u == user],
-                           observations=[o for o in p.observations if o.u == user])
-            _, r,_ = greedy_eoscsp_solver(sub_p)
+            _, r, _ = user_plans[user.id]
             
-            plans.extend([x for value in r.values() for x in value])
+            plans.extend(x for value in r.values() for x in value)
             R_ex[user.id] = r
     
-    processed_requests = set()
-    for i in range(len(not_exclusive_requests)):
-        # bids
-        bids = [bid(not_exclusive_requests[i], R_ex[user.id]) for user in p.users[1:]]
-        B_u, sig_u = [b[0] for b in bids], [b[1] for b in bids]
-        max_bid = np.max(B_u)
-        
-        # pass if no exclusive user scheduled this request
-        if max_bid <= 0:
-            continue
-        
-        w = np.where(B_u == max_bid)[0]
-        w = np.random.choice(w)  # randomly choose one if there are multiple max bids
+    bids_cache = BidCache(not_exclusive_requests, {user.id: R_ex[user.id] for user in p.users[1:]})
+    with instrument.phase('ssi.bids'):
+        bids_cache.fill(not_exclusive_requests)
+    
+    with instrument.phase('ssi.auction'):
+        processed_requests = set()
+        for i in range(len(not_exclusive_requests)):
+            # bids
+            bids = [bids_cache.get(user.id, not_exclusive_requests[i]) for user in p.users[1:]]
+            bids_cache.done(not_exclusive_requests[i])
+            B_u, sig_u = [b[0] for b in bids], [b[1] for b in bids]
+            max_bid = np.max(B_u)
+            
+            # pass if no exclusive user scheduled this request
+            if max_bid <= 0:
+                continue
+            
+            w = np.where(B_u == max_bid)[0]
+            w = rng.choice(w)  # randomly choose one if there are multiple max bids
+            
+            added, removed = try_add(plans, sig_u[w])
+            if added:
+                sat = sig_u[w][0].s
+                plans.add(sig_u[w][0], sig_u[w][1])
+                # bids do not modify the plans, only the winner commits the observation
+                R_ex[p.users[1 + w].id][sat.id].add(sig_u[w][0], sig_u[w][1])
+                bids_cache.invalidate(p.users[1 + w].id, sat.id)
+                processed_requests.add(not_exclusive_requests[i].id)
+                for i in removed:
+                    if i in processed_requests:
+                        processed_requests.remove(i)
+    
+    R_ex = plans.plan()
+    
+    with instrument.phase('ssi.p_u0'):
+        # add non exclusive requests
+        remaining_requests = [req for req in not_exclusive_requests if req.id not in processed_requests]
+        obs = [obs for req in remaining_requests for obs in req.theta]
+        p_u0 = EOSCSP(satellites=p.satellites, users=[p.users[0]], requests=remaining_requests, observations=obs)
         
-        added, removed = try_add(plans, sig_u[w])
-        if added:
-            sat = sig_u[w][0].s
-            plans.append((sig_u[w][0], (sat, sig_u[w][1])))
-            processed_requests.add(not_exclusive_requests[i].id)
-            for i in removed:
-                if i in processed_requests:
-                    processed_requests.remove(i)
-    
-    plans.sort(key=lambda x: (x[1][1]))
-    R_ex = {sat.id: [] for sat in p.satellites}
-    for obs, (start, end) in plans:
-        R_ex[obs.s.id].append((obs, (start, end)))
-    
-    # add non exclusive requests
-    remaining_requests = [req for req in not_exclusive_requests if req.id not in processed_requests]
-    obs = [obs for req in remaining_requests for obs in req.theta]
-    p_u0 = EOSCSP(satellites=p.satellites, users=[p.users[0]], requests=remaining_requests, observations=obs)
-    
-    _, r,_ = greedy_eoscsp_solver(p_u0, R_ex)
+        _, r,_ = greedy_eoscsp_solver(p_u0, R_ex)
     M = [x for value in r.values() for x in value]
     
     # Calculate total reward
     total_reward = sum([o.rho for o, _ in M])
-    print("Reward of ssi: ", total_reward)
+    instrument.report('ssi', total_reward)
     
     final_solution = {}
     for observation, (satellite, start_time) in M:
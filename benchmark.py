@@ -0,0 +1,161 @@
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from auction import psi_solver, ssi_solver
+from distributed import distributed_psi_solver, distributed_ssi_solver
+from eoscsp import EOSCSP
+from greedy import greedy_eoscsp_solver
+from sdcop import s_dcop
+from utils import generate_large_instance
+
+# each solver returns the total reward of its schedule
+SOLVERS: Dict[str, Callable[[EOSCSP], float]] = {
+    'greedy': lambda p: greedy_eoscsp_solver(p)[2],
+    'sdcop': lambda p: s_dcop(p)[1],
+    'psi': lambda p: psi_solver(p)[1],
+    'ssi': lambda p: ssi_solver(p)[1],
+    'psi-distributed': lambda p: distributed_psi_solver(p)[1],
+    'ssi-distributed': lambda p: distributed_ssi_solver(p)[1],
+}
+
+FIELDS = ['solver', 'satellites', 'users', 'requests', 'observations', 'seed', 'repeat', 'wall_time', 'peak_memory', 'reward']
+
+
+def measure(solver: Callable[[EOSCSP], float], p: EOSCSP, seed: int, memory: bool = False):
+    # one run of a solver, its output is discarded and np.random (used by ssi) is seeded so that runs are repeatable
+    np.random.seed(seed)
+    if memory:
+        tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        reward = solver(p)
+        wall_time = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return wall_time, peak, reward
+
+
+def run_benchmark(satellites: List[int], users: List[int], requests: List[int], solvers: List[str] = None, repeats: int = 3,
+                  warmup: int = 1, seed: int = 0, end_time: float = 20, log=sys.stderr) -> List[Dict]:
+    """
+    Run each solver on the seeded instance of every (satellites, users, requests) combination.
+    Every configuration gets `warmup` untimed runs, then `repeats` timed runs, and a last run under tracemalloc for the peak
+    memory (tracing slows the solvers down, so it is kept out of the timed runs).
+    :return: One record per timed run, with the FIELDS keys.
+    """
+    if repeats < 1:
+        raise ValueError(f'at least one timed run is needed, got repeats={repeats}')
+    solvers = solvers or list(SOLVERS)
+    results = []
+    for num_satellites, num_users, num_requests in itertools.product(satellites, users, requests):
+        p = generate_large_instance(num_satellites, num_users, num_requests, seed=seed, end_time=end_time)
+        for name in solvers:
+            for _ in range(warmup):
+                measure(SOLVERS[name], p, seed)
+            runs = [measure(SOLVERS[name], p, seed) for _ in range(repeats)]
+            _, peak, _ = measure(SOLVERS[name], p, seed, memory=True)
+            for repeat, (wall_time, _, reward) in enumerate(runs):
+                results.append({'solver': name, 'satellites': num_satellites, 'users': num_users, 'requests': num_requests,
+                                'observations': len(p.observations), 'seed': seed, 'repeat': repeat, 'wall_time': wall_time,
+                                'peak_memory': peak, 'reward': reward})
+            if log:
+                times = [wall_time for wall_time, _, _ in runs]
+                print(f'{name:>6} S={num_satellites} U={num_users} R={num_requests}: {statistics.median(times):.4f}s, '
+                      f'{peak / 2 ** 20:.1f} MiB, reward {runs[-1][2]:.2f}', file=log)
+    return results
+
+
+def save_results(results: List[Dict], path: str):
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=1)
+
+
+def load_results(path: str) -> List[Dict]:
+    if path.endswith('.csv'):
+        with open(path, newline='') as file:
+            return [{key: value if key == 'solver' else float(value) for key, value in row.items()} for row in csv.DictReader(file)]
+    with open(path) as file:
+        return json.load(file)
+
+
+def summarize(results: List[Dict]) -> Dict[tuple, Dict[str, float]]:
+    # median over the repeats of each (solver, satellites, users, requests, seed)
+    groups = {}
+    for r in results:
+        key = (r['solver'], int(r['satellites']), int(r['users']), int(r['requests']), int(r['seed']))
+        groups.setdefault(key, []).append(r)
+    return {key: {field: statistics.median(float(r[field]) for r in runs) for field in ('wall_time', 'peak_memory', 'reward')}
+            for key, runs in groups.items()}
+
+
+def compare_results(baseline: List[Dict], candidate: List[Dict], threshold: float = 0.1) -> List[str]:
+    """
+    Compare the medians of two result sets on their common configurations.
+    :return: A message for each regression: wall time or peak memory growing by more than `threshold` (relative), or a lower reward.
+    """
+    before, after = summarize(baseline), summarize(candidate)
+    regressions = []
+    for key in sorted(before.keys() & after.keys()):
+        name = '{} S={} U={} R={} seed={}'.format(*key)
+        for field in ('wall_time', 'peak_memory'):
+            if after[key][field] > before[key][field] * (1 + threshold):
+                regressions.append(f'{name}: {field} {before[key][field]:.6g} -> {after[key][field]:.6g}')
+        if after[key]['reward'] < before[key]['reward']:
+            regressions.append(f'{name}: reward {before[key]["reward"]:.6g} -> {after[key]["reward"]:.6g}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the EOSCSP solvers.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='sweep instance sizes and record wall time, peak memory and reward')
+    run.add_argument('--satellites', type=int, nargs='+', default=[10])
+    run.add_argument('--users', type=int, nargs='+', default=[7])
+    run.add_argument('--requests', type=int, nargs='+', default=[20, 40, 80])
+    run.add_argument('--solvers', nargs='+', choices=list(SOLVERS), default=list(SOLVERS))
+    run.add_argument('--repeats', type=int, default=3)
+    run.add_argument('--warmup', type=int, default=1)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--end-time', type=float, default=20, help='end of the planning horizon, which starts at 2')
+    run.add_argument('-o', '--output', default='benchmark.json', help='.json or .csv file')
+    compare = commands.add_parser('compare', help='flag the regressions of a result file against a baseline')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, default=0.1, help='relative tolerance on wall time and peak memory')
+    args = parser.parse_args(argv)
+    
+    if args.command == 'run':
+        if args.repeats < 1:
+            parser.error('--repeats must be at least 1')
+        results = run_benchmark(args.satellites, args.users, args.requests, args.solvers, args.repeats, args.warmup, args.seed,
+                                args.end_time)
+        save_results(results, args.output)
+        return 0
+    
+    regressions = compare_results(load_results(args.baseline), load_results(args.candidate), args.threshold)
+    for regression in regressions:
+        print(regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+
+from eoscsp import EOSCSP, Observation, Request, Satellite, User
+
+ID = np.int32
+
+
+@dataclass
+class ColumnarEOSCSP:
+    r"""
+    Struct-of-arrays form of an EOSCSP :math:`P = (S, U, R, O)`: one NumPy array per attribute, the references between the objects
+    being replaced by ids (the `id` of the satellites, users, requests and observations of the object model).
+    :param sat_id, sat_start, sat_end, sat_capacity, sat_transition: The satellites.
+    :param user_id, user_p: The users.
+    :param excl_user, excl_sat, excl_start, excl_end: The exclusive windows, one row per (u, (s, (t^start, t^end))) of e_u.
+    :param req_id, req_t_start, req_t_end, req_reward, req_user: The requests.
+    :param obs_id, obs_i, t_start, t_end, delta, rho, priority, satellite, user, request: The observations.
+    """
+    sat_id: np.ndarray
+    sat_start: np.ndarray
+    sat_end: np.ndarray
+    sat_capacity: np.ndarray
+    sat_transition: np.ndarray
+    user_id: np.ndarray
+    user_p: np.ndarray
+    excl_user: np.ndarray
+    excl_sat: np.ndarray
+    excl_start: np.ndarray
+    excl_end: np.ndarray
+    req_id: np.ndarray
+    req_t_start: np.ndarray
+    req_t_end: np.ndarray
+    req_reward: np.ndarray
+    req_user: np.ndarray
+    obs_id: np.ndarray
+    obs_i: np.ndarray
+    t_start: np.ndarray
+    t_end: np.ndarray
+    delta: np.ndarray
+    rho: np.ndarray
+    priority: np.ndarray
+    satellite: np.ndarray
+    user: np.ndarray
+    request: np.ndarray
+    
+    @classmethod
+    def from_eoscsp(cls, p: EOSCSP) -> 'ColumnarEOSCSP':
+        exclusive = [(u.id, s.id, start, end) for u in p.users for s, (start, end) in u.exclusive_times]
+        o = p.observations
+        return cls(sat_id=np.array([s.id for s in p.satellites], dtype=ID),
+                   sat_start=np.array([s.start_time for s in p.satellites], dtype=float),
+                   sat_end=np.array([s.end_time for s in p.satellites], dtype=float),
+                   sat_capacity=np.array([s.capacity for s in p.satellites], dtype=ID),
+                   sat_transition=np.array([s.transition_time for s in p.satellites], dtype=float),
+                   user_id=np.array([u.id for u in p.users], dtype=ID), user_p=np.array([u.p for u in p.users], dtype=ID),
+                   excl_user=np.array([e[0] for e in exclusive], dtype=ID), excl_sat=np.array([e[1] for e in exclusive], dtype=ID),
+                   excl_start=np.array([e[2] for e in exclusive], dtype=float),
+                   excl_end=np.array([e[3] for e in exclusive], dtype=float),
+                   req_id=np.array([r.id for r in p.requests], dtype=ID),
+                   req_t_start=np.array([r.t_start for r in p.requests], dtype=float),
+                   req_t_end=np.array([r.t_end for r in p.requests], dtype=float),
+                   req_reward=np.array([r.reward for r in p.requests], dtype=float),
+                   req_user=np.array([r.u.id for r in p.requests], dtype=ID),
+                   obs_id=np.array([x.id for x in o], dtype=ID), obs_i=np.array([x.i for x in o], dtype=ID),
+                   t_start=np.array([x.t_start for x in o], dtype=float), t_end=np.array([x.t_end for x in o], dtype=float),
+                   delta=np.array([x.delta for x in o], dtype=float), rho=np.array([x.rho for x in o], dtype=float),
+                   priority=np.array([x.p for x in o], dtype=ID), satellite=np.array([x.s.id for x in o], dtype=ID),
+                   user=np.array([x.u.id for x in o], dtype=ID), request=np.array([x.request.id for x in o], dtype=ID))
+    
+    def to_eoscsp(self) -> EOSCSP:
+        # rebuild the object model, keeping the ids of the columns
+        satellites = [Satellite(start_time=float(start), end_time=float(end), capacity=int(capacity), transition_time=float(transition),
+                                id=int(satid))
+                      for satid, start, end, capacity, transition in
+                      zip(self.sat_id, self.sat_start, self.sat_end, self.sat_capacity, self.sat_transition)]
+        sat_by_id = {s.id: s for s in satellites}
+        users = [User(exclusive_times=[], p=int(p), id=int(userid)) for userid, p in zip(self.user_id, self.user_p)]
+        user_by_id = {u.id: u for u in users}
+        for userid, satid, start, end in zip(self.excl_user, self.excl_sat, self.excl_start, self.excl_end):
+            user_by_id[int(userid)].exclusive_times.append((sat_by_id[int(satid)], (float(start), float(end))))
+        requests = []
+        for reqid, t_start, t_end, reward, userid in zip(self.req_id, self.req_t_start, self.req_t_end, self.req_reward, self.req_user):
+            request = Request(float(t_start), float(t_end), float(reward), user_by_id[int(userid)])
+            request.id = int(reqid)
+            requests.append(request)
+        req_by_id = {r.id: r for r in requests}
+        observations = []
+        for row in zip(self.obs_id, self.obs_i, self.t_start, self.t_end, self.delta, self.request, self.rho, self.satellite, self.user,
+                       self.priority):
+            obsid, i, t_start, t_end, delta, reqid, rho, satid, userid, p = row
+            request = req_by_id[int(reqid)]
+            observation = Observation(int(i), float(t_start), float(t_end), float(delta), request, float(rho), sat_by_id[int(satid)],
+                                      user_by_id[int(userid)], int(p))
+            observation.id = int(obsid)
+            request.theta.append(observation)
+            observations.append(observation)
+        return EOSCSP(satellites=satellites, users=users, requests=requests, observations=observations)
+    
+    def __len__(self):
+        return len(self.obs_id)
+    
+    @property
+    def nbytes(self) -> int:
+        return sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
+    
+    def observations_of_user(self, userid: int) -> np.ndarray:
+        # row indices of the observations of a user
+        return np.flatnonzero(self.user == userid)
+    
+    def observations_of_satellite(self, satid: int) -> np.ndarray:
+        return np.flatnonzero(self.satellite == satid)
+    
+    def group_by(self, column: np.ndarray) -> Dict[int, np.ndarray]:
+        # row indices of the observations for each value of a column, e.g. group_by(self.user), in a single sort
+        order = np.argsort(column, kind='stable')
+        keys, first = np.unique(column[order], return_index=True)
+        return {int(key): rows for key, rows in zip(keys, np.split(order, first[1:]))}
+    
+    def exclusive_mask(self) -> np.ndarray:
+        # observations whose owner has exclusive windows
+        return np.isin(self.user, self.excl_user)
+    
+    def observation(self, row: int) -> 'ObservationView':
+        return ObservationView(self, row)
+    
+    def views(self, rows: np.ndarray = None):
+        rows = range(len(self)) if rows is None else rows
+        return [ObservationView(self, int(row)) for row in rows]
+
+
+class ObservationView:
+    """
+    Read-only view of a row of a ColumnarEOSCSP, with the attribute names of Observation for code that works on objects.
+    References to other objects are given as ids: `s`, `u` and `request` hold the satellite, user and request ids.
+    """
+    __slots__ = ('_p', '_row')
+    
+    def __init__(self, p: ColumnarEOSCSP, row: int):
+        self._p = p
+        self._row = row
+    
+    def __repr__(self):
+        return f'ObservationView(id={self.id}, t_start={self.t_start}, t_end={self.t_end}, s={self.s}, u={self.u})'
+    
+    @property
+    def id(self) -> int:
+        return int(self._p.obs_id[self._row])
+    
+    @property
+    def i(self) -> int:
+        return int(self._p.obs_i[self._row])
+    
+    @property
+    def t_start(self) -> float:
+        return float(self._p.t_start[self._row])
+    
+    @property
+    def t_end(self) -> float:
+        return float(self._p.t_end[self._row])
+    
+    @property
+    def delta(self) -> float:
+        return float(self._p.delta[self._row])
+    
+    @property
+    def rho(self) -> float:
+        return float(self._p.rho[self._row])
+    
+    @property
+    def p(self) -> int:
+        return int(self._p.priority[self._row])
+    
+    @property
+    def s(self) -> int:
+        return int(self._p.satellite[self._row])
+    
+    @property
+    def u(self) -> int:
+        return int(self._p.user[self._row])
+    
+    @property
+    def request(self) -> int:
+        return int(self._p.request[self._row])
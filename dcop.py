@@ -1,78 +1,117 @@
-import yaml
-from pydcop.algorithms import *
-from pydcop.dcop.yamldcop import load_dcop_from_file
-from pydcop.infrastructure.run import solve
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
 
+import numpy as np
+
+from dcop_backend import CONSTRAINT_REWARD, DcopModel
 from eoscsp import EOSCSP, Observation, Satellite, User
+from intervals import ExclusiveIndex
 from utils import generate_random_esop_instance
 
 
 # 首先，定义一个函数来为DCOP创建代理
-def create_agents(users: List[User]) -> List[str]:
-    agents = [str(user.id) for user in users]
+def create_agents(model: DcopModel) -> List[str]:
+    # 只为持有变量的用户创建代理
+    agents = list(model.distribution())
     return agents
 
 
-# 定义一个函数来为DCOP创建变量
-def create_variables(observations: List[Observation], users: List[User]) -> Dict[str, Dict]:
-    variables = {}
-    for user in users:
-        for obs in observations:
-            var_name = f"x_{user.id}_{obs.id}"
-            variables[var_name] = {'domain': 'binary', 'initial_value': 0}
-    return variables
+# 能接受观测的用户: 观测的所有者, 以及独占时间窗与观测时间窗重叠的用户
+def candidate_users(o: Observation, index: ExclusiveIndex) -> List[int]:
+    users = {o.u.id}
+    users.update(index.owners(o.s.id, o.t_start, o.t_end))
+    return sorted(users)
+
+
+# 定义一个函数来为DCOP创建变量, 变量数与实际的交互数成正比, 而不是 |U|·|O|
+def create_variables(model: DcopModel, observations: List[Observation], users: List[User]) -> Dict[int, List[str]]:
+    index = ExclusiveIndex(users)
+    candidates = {obs.id: candidate_users(obs, index) for obs in observations}
+    # 收益按比例缩小, 使所有收益之和小于一个约束的收益, 违反约束永远不划算
+    scale = CONSTRAINT_REWARD / (sum(obs.rho * len(candidates[obs.id]) for obs in observations) + 1)
+    obs_vars = {}
+    for obs in observations:
+        obs_vars[obs.id] = [model.add_variable(userid, obs.s.id, obs.id, obs.rho * scale) for userid in candidates[obs.id]]
+    return obs_vars
 
 
 # 定义一个函数来为DCOP创建约束
-def create_constraints(satellites: List[Satellite], observations: List[Observation], users: List[User]) -> Dict[str, Dict]:
-    constraints = {}
-    # 添加每个请求最多一个观测的约束
+def create_constraints(model: DcopModel, satellites: List[Satellite], observations: List[Observation],
+                       obs_vars: Dict[int, List[str]]):
+    # 每个请求最多一个观测 (也保证了每个观测最多一个代理)
+    request_vars = defaultdict(list)
+    sat_vars = defaultdict(list)
     for obs in observations:
-        constraint_name = f"request_max_one_{obs.request.id}"
-        constraints[constraint_name] = {'type': 'intention',
-                                        'function': f"sum([{', '.join(f'x_{user.id}_{obs.id}' for user in users)}]) <= 1"}
-    # 添加卫星容量约束
+        request_vars[obs.request.id].extend(obs_vars[obs.id])
+        sat_vars[obs.s.id].extend(obs_vars[obs.id])
+    for reqid, var_list in request_vars.items():
+        if len(var_list) > 1:
+            model.add_constraint(f'request_max_one_{reqid}', var_list, 1)
+    # 卫星容量约束, 只在容量可能被超过时添加
     for sat in satellites:
-        constraint_name = f"satellite_capacity_{sat.id}"
-        constraints[constraint_name] = {'type': 'intention',
-                                        'function': f"sum(["
-                                                    f"{', '.join(f'x_{user.id}_{obs.id}' for user in users for obs in observations if obs.s == sat)}]) <= "
-                                                    f"{sat.capacity}"}
-    # 添加每个观测最多一个代理的约束
-    for obs in observations:
-        constraint_name = f"observation_single_agent_{obs.id}"
-        constraints[constraint_name] = {'type': 'intention',
-                                        'function': f"sum([{', '.join(f'x_{user.id}_{obs.id}' for user in users)}]) <= 1"}
-    return constraints
+        if len(sat_vars[sat.id]) > sat.capacity:
+            model.add_constraint(f'satellite_capacity_{sat.id}', sat_vars[sat.id], sat.capacity)
 
 
 # 构建DCOP实例
-def build_DCOP(satellites: List[Satellite], users: List[User], observations: List[Observation]) -> Dict:
-    agents = create_agents(users)
-    variables = create_variables(observations, users)
-    constraints = create_constraints(satellites, observations, users)
+def build_DCOP(satellites: List[Satellite], users: List[User], observations: List[Observation]) -> DcopModel:
+    model = DcopModel()
+    obs_vars = create_variables(model, observations, users)
+    create_constraints(model, satellites, observations, obs_vars)
+    return model
+
+
+# 编译后的约束函数: 满足 sum <= limit 时取 CONSTRAINT_REWARD
+def at_most(limit: int) -> Callable[..., int]:
+    def constraint(*values: int) -> int:
+        return CONSTRAINT_REWARD if sum(values) <= limit else 0
+    
+    return constraint
+
+
+# 在内存中构建 pyDCOP 的对象, 不经过 YAML 文件
+def to_pydcop(model: DcopModel) -> Tuple:
+    from pydcop.dcop.dcop import DCOP
+    from pydcop.dcop.objects import AgentDef, Domain, Variable
+    from pydcop.dcop.relations import NAryFunctionRelation, NAryMatrixRelation
+    from pydcop.distribution.objects import Distribution
     
-    dcop_instance = {'agents': agents, 'variables': variables, 'domains': {'binary': {'type': 'binary', 'values': [0, 1]}},
-                     'constraints': constraints, 'objective': 'max', 'description': 'EOSCSP', 'name': 'EOSCSP'}
-    return dcop_instance
+    domain = Domain('binary', 'binary', [0, 1])
+    variables = {var_name: Variable(var_name, domain, 0) for var_name in model.variables}
+    dcop = DCOP('EOSCSP', objective='max', description='EOSCSP')
+    # 每个变量的收益是一元的表约束
+    for var_name, reward in model.rewards.items():
+        dcop.add_constraint(NAryMatrixRelation([variables[var_name]], np.array([0, reward]), name=f'reward_{var_name}'))
+    for name, scope, limit in model.constraints:
+        dcop.add_constraint(NAryFunctionRelation(at_most(limit), [variables[var_name] for var_name in scope], name=name))
+    dcop.add_agents([AgentDef(agent) for agent in create_agents(model)])
+    return dcop, Distribution(model.distribution())
 
 
 # DCOP求解器
-def solve_dcop(dcop_instance: Dict) -> Dict:
-    # 将 DCOP 实例保存到 YAML 文件
-    with open('dcop.yaml', 'w') as f:
-        yaml.dump(dcop_instance, f)
+def solve_dcop(model: DcopModel, algo: str = 'dpop', timeout: float = 5) -> Dict[str, int]:
+    from pydcop.infrastructure.run import solve
     
-    # 调用 pyDCOP 解算器
-    dcop = load_dcop_from_file(['dcop.yaml'])
-    distribution_strategy = 'oneagent'  # 'adhoc'
-    assignment = solve(dcop, algo_def='dpop', distribution=distribution_strategy)
+    if not model.variables:
+        return {}
+    dcop, distribution = to_pydcop(model)
+    assignment = solve(dcop, algo, distribution, timeout=timeout)
     
     return assignment
 
 
+# 将取值为1的变量转换为 {obs_id: (satellite, start_time)}, 观测在时间窗开始时执行
+def to_schedule(model: DcopModel, assignment: Dict[str, int], eoscsp_instance: EOSCSP) -> Dict[int, Tuple[Satellite, float]]:
+    schedule = {}
+    for var_name, value in assignment.items():
+        if value:
+            _, satid, obsid = model.variables[var_name]
+            schedule[obsid] = (eoscsp_instance.satellite(satid), eoscsp_instance.observation(obsid).t_start)
+    return schedule
+
+
 # 可视化解决方案
-def visualize_solution(solution: Dict, eoscsp_instance: EOSCSP):
+def visualize_solution(solution: Dict[int, Tuple[Satellite, float]], eoscsp_instance: EOSCSP):
     # 调用EOSCSP实例的绘图方法
     eoscsp_instance.plot_schedule(solution)
 
@@ -84,7 +123,8 @@ if __name__ == '__main__':
     dcop_instance = build_DCOP(eoscsp_instance.satellites, eoscsp_instance.users, eoscsp_instance.observations)
     
     # 解决DCOP问题
-    solution = solve_dcop(dcop_instance)
+    assignment = solve_dcop(dcop_instance)
+    solution = to_schedule(dcop_instance, assignment, eoscsp_instance)
     
     # 可视化解决方案
     visualize_solution(solution, eoscsp_instance)
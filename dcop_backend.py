@@ -0,0 +1,288 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import yaml
+
+import instrument
+
+# value of a satisfied constraint in the objective, as in the `100 if ... else 0` intention constraints
+CONSTRAINT_REWARD = 100
+
+
+@dataclass
+class DcopModel:
+    r"""
+    In-memory form of the DCOP solved by S-DCOP for a request: binary variables :math:`x_{u,s,o}` owned by the exclusive users,
+    and constraints of the form :math:`\sum x \le limit` each worth `CONSTRAINT_REWARD` when satisfied.
+    The objective to maximize is the sum of the satisfied constraints plus :math:`\sum x_{u,s,o} \cdot reward_{u,s,o}`.
+    :param variables: Mapping from variable name to (user id, satellite id, observation id).
+    :param rewards: The reward of setting a variable to 1.
+    :param constraints: The (name, scope, limit) of each constraint.
+    """
+    variables: Dict[str, Tuple[int, int, int]] = field(default_factory=dict)
+    rewards: Dict[str, float] = field(default_factory=dict)
+    constraints: List[Tuple[str, List[str], int]] = field(default_factory=list)
+    
+    def add_variable(self, userid: int, satid: int, obsid: int, reward: float) -> str:
+        var_name = f'x_{userid}_{satid}_{obsid}'
+        self.variables[var_name] = (userid, satid, obsid)
+        self.rewards[var_name] = reward
+        return var_name
+    
+    def add_constraint(self, name: str, scope: List[str], limit: int):
+        self.constraints.append((name, scope, limit))
+    
+    def distribution(self) -> Dict[str, List[str]]:
+        # each variable is hosted by the agent of its user
+        distribution = {}
+        for var_name, (userid, _, _) in self.variables.items():
+            distribution.setdefault(f'u_{userid}', []).append(var_name)
+        return distribution
+    
+    def to_yaml(self) -> Tuple[Dict, Dict[str, List[str]]]:
+        # pydcop representation of the model, with intention constraints
+        distribution = self.distribution()
+        dcop_data = {'name': 'EOSCSP', 'objective': 'max', 'domains': {'binary_decision': {'values': [0, 1]}},
+                     'variables': {var_name: {'domain': 'binary_decision'} for var_name in self.variables}, 'agents': list(distribution),
+                     'constraints': {}}
+        for name, scope, limit in self.constraints:
+            dcop_data['constraints'][name] = {'type': 'intention',
+                                              'function': f'{CONSTRAINT_REWARD} if sum([{", ".join(scope)}]) <= {limit} else 0'}
+        cost_function = [f'{var_name} * {reward}' for var_name, reward in self.rewards.items()]
+        dcop_data['constraints']['cost'] = {'type': 'intention', 'function': f'sum([{", ".join(cost_function)}])'}
+        return dcop_data, distribution
+
+
+class DcopBackend:
+    """
+    A solver for the DCOP models built by S-DCOP. `solve` returns the assignment as a mapping from variable name to value.
+    Backends holding resources (processes, files) release them in `close`, they can also be used as context managers.
+    """
+    
+    def solve(self, model: DcopModel) -> Dict[str, int]:
+        raise NotImplementedError
+    
+    def close(self):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NativeBackend(DcopBackend):
+    """
+    Exact in-process solver. The variables are split into independent components (variables linked by a constraint), and each
+    component is solved by a depth-first branch and bound, trying 0 before 1 so that ties are resolved towards not scheduling.
+    """
+    
+    def solve(self, model: DcopModel) -> Dict[str, int]:
+        assignment = {var_name: 0 for var_name in model.variables}
+        for variables, constraints in components(model):
+            assignment.update(self._solve_component(variables, constraints, model.rewards))
+        return assignment
+    
+    @staticmethod
+    def _solve_component(variables: List[str], constraints: List[Tuple[str, List[str], int]], rewards: Dict[str, float]):
+        # branch on the most rewarding variables first, the bound is the value of the current partial assignment plus all the
+        # positive rewards left plus every constraint not violated yet (a violated constraint stays violated when adding ones)
+        variables = sorted(variables, key=lambda v: -rewards[v])
+        scopes = defaultdict(list)
+        for c, (_, scope, _) in enumerate(constraints):
+            for var_name in scope:
+                scopes[var_name].append(c)
+        limits = [limit for _, _, limit in constraints]
+        remaining = [0.0] * (len(variables) + 1)
+        for i in range(len(variables) - 1, -1, -1):
+            remaining[i] = remaining[i + 1] + max(rewards[variables[i]], 0)
+        
+        counts = [0] * len(constraints)
+        values = [0] * len(variables)
+        best = [float('-inf'), None]
+        
+        def search(i, reward, violated):
+            bound = reward + remaining[i] + CONSTRAINT_REWARD * (len(constraints) - violated)
+            if bound <= best[0]:
+                return
+            if i == len(variables):
+                best[0], best[1] = reward + CONSTRAINT_REWARD * (len(constraints) - violated), list(values)
+                return
+            search(i + 1, reward, violated)
+            newly_violated = 0
+            for c in scopes[variables[i]]:
+                counts[c] += 1
+                if counts[c] == limits[c] + 1:
+                    newly_violated += 1
+            values[i] = 1
+            search(i + 1, reward + rewards[variables[i]], violated + newly_violated)
+            values[i] = 0
+            for c in scopes[variables[i]]:
+                counts[c] -= 1
+        
+        # constraints already violated by an all-zero assignment (negative remaining capacity)
+        search(0, 0.0, sum(1 for limit in limits if limit < 0))
+        return dict(zip(variables, best[1]))
+
+
+def components(model: DcopModel) -> List[Tuple[List[str], List[Tuple[str, List[str], int]]]]:
+    # connected components of the constraint graph, with their variables and constraints
+    parent = {var_name: var_name for var_name in model.variables}
+    
+    def find(v):
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+    
+    for _, scope, _ in model.constraints:
+        for var_name in scope[1:]:
+            parent[find(var_name)] = find(scope[0])
+    
+    groups = defaultdict(lambda: ([], []))
+    for var_name in model.variables:
+        groups[find(var_name)][0].append(var_name)
+    for constraint in model.constraints:
+        if constraint[1]:
+            groups[find(constraint[1][0])][1].append(constraint)
+    return list(groups.values())
+
+
+class PydcopFileBackend(DcopBackend):
+    """
+    The original path: the model is written to `dcop.yaml` and `distribution.yaml`, and solved by a `pydcop solve` subprocess.
+    """
+    
+    def __init__(self, algo: str = 'dpop', directory: str = '.'):
+        self.algo = algo
+        self.directory = directory
+    
+    def solve(self, model: DcopModel) -> Dict[str, int]:
+        if not model.variables:
+            return {}
+        dcop_data, distribution = model.to_yaml()
+        dcop_file = os.path.join(self.directory, 'dcop.yaml')
+        distribution_file = os.path.join(self.directory, 'distribution.yaml')
+        with instrument.phase('dcop.write'):
+            write_yaml(distribution_file, {'distribution': distribution})
+            write_yaml(dcop_file, dcop_data)
+        return run_pydcop(dcop_file, distribution_file, self.algo)
+
+
+def write_yaml(path: str, data: Dict):
+    text = yaml.dump(data, default_flow_style=False)
+    with open(path, 'w') as file:
+        file.write(text)
+    instrument.count('dcop.bytes_written', len(text))
+
+
+def run_pydcop(dcop_file: str = 'dcop.yaml', distribution_file: str = 'distribution.yaml', algo: str = 'dpop') -> Dict[str, int]:
+    # solve with a `pydcop solve` subprocess, a RuntimeError is raised if pydcop is missing, fails or does not print an assignment
+    instrument.count('dcop.subprocesses')
+    command = ['pydcop', 'solve', '--algo', algo, dcop_file, '-d', distribution_file]
+    try:
+        process = subprocess.run(command, capture_output=True, text=True, check=True)
+        result = json.loads(process.stdout)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f'pydcop failed on {dcop_file} (exit status {e.returncode}): {e.stderr.strip()}') from e
+    except OSError as e:
+        raise RuntimeError(f'cannot run pydcop: {e}') from e
+    except ValueError as e:
+        raise RuntimeError(f'pydcop did not print an assignment for {dcop_file}: {e}') from e
+    return result.get('assignment', {})
+
+
+class PydcopWorkerBackend(DcopBackend):
+    """
+    Keeps a single Python process with pydcop imported alive across requests. Models are sent as YAML over the worker's stdin, one
+    JSON message per line, and the assignments are read back from its stdout.
+    """
+    
+    def __init__(self, algo: str = 'dpop'):
+        self.algo = algo
+        self.process = None
+    
+    def _start(self):
+        instrument.count('dcop.subprocesses')
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker'], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, text=True)
+    
+    def solve(self, model: DcopModel) -> Dict[str, int]:
+        if not model.variables:
+            return {}
+        if self.process is None or self.process.poll() is not None:
+            self._start()
+        dcop_data, distribution = model.to_yaml()
+        message = json.dumps({'algo': self.algo, 'dcop': yaml.dump(dcop_data), 'distribution': yaml.dump({'distribution': distribution})})
+        instrument.count('dcop.bytes_written', len(message) + 1)
+        try:
+            self.process.stdin.write(message + '\n')
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (BrokenPipeError, EOFError, OSError) as e:
+            # the worker died, the next solve starts a new one
+            raise RuntimeError(f'the pydcop worker exited with status {self._stop()}') from e
+        if not line:
+            raise RuntimeError(f'the pydcop worker exited with status {self._stop()}')
+        try:
+            result = json.loads(line)
+        except ValueError as e:
+            raise RuntimeError(f'the pydcop worker did not reply with an assignment: {line.strip()}') from e
+        if 'error' in result:
+            raise RuntimeError(f"the pydcop worker failed: {result['error']}")
+        return result.get('assignment', {})
+    
+    def _stop(self) -> int:
+        # close the pipes of the worker, wait for it and return its exit status
+        process, self.process = self.process, None
+        for pipe in (process.stdin, process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        return process.wait()
+    
+    def close(self):
+        if self.process is not None:
+            self._stop()
+
+
+def serve_worker():
+    # worker side of PydcopWorkerBackend, pydcop is only imported here
+    from pydcop.dcop.yamldcop import load_dcop
+    from pydcop.distribution.yamlformat import load_dist
+    from pydcop.infrastructure.run import solve
+    
+    # pydcop may print while solving, keep stdout for the replies
+    out, sys.stdout = sys.stdout, sys.stderr
+    for line in sys.stdin:
+        message = json.loads(line)
+        try:
+            dcop = load_dcop(message['dcop'])
+            assignment = solve(dcop, message['algo'], load_dist(message['distribution']))
+            reply = {'assignment': assignment}
+        except Exception as e:
+            reply = {'error': repr(e)}
+        out.write(json.dumps(reply) + '\n')
+        out.flush()
+
+
+BACKENDS = {'native': NativeBackend, 'pydcop': PydcopWorkerBackend, 'file': PydcopFileBackend}
+
+
+def get_backend(backend='native') -> DcopBackend:
+    # accept a backend instance or one of the names in BACKENDS
+    if isinstance(backend, DcopBackend):
+        return backend
+    return BACKENDS[backend]()
+
+
+if __name__ == '__main__':
+    if '--worker' in sys.argv:
+        serve_worker()
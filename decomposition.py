@@ -0,0 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple, Union
+
+import instrument
+from auction import psi_solver, ssi_solver
+from eoscsp import EOSCSP, Satellite
+from greedy import greedy_eoscsp_solver
+from sdcop import s_dcop
+
+# the first element of the result of each solver is the {obs_id: (satellite, start_time)} schedule
+SOLVERS: Dict[str, Callable] = {
+    'greedy': greedy_eoscsp_solver,
+    'psi': psi_solver,
+    'ssi': ssi_solver,
+    'sdcop': s_dcop,
+}
+
+
+def _find(parent: List[int], i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _union(parent: List[int], i: int, j: int):
+    i, j = _find(parent, i), _find(parent, j)
+    if i != j:
+        parent[max(i, j)] = min(i, j)
+
+
+def decompose(p: EOSCSP) -> List[EOSCSP]:
+    r"""
+    Split an instance into independent sub-instances, the connected components of the interaction graph of its observations:
+    - the observations of a request :math:`\theta_r` are connected, only one of them is scheduled,
+    - on a satellite whose capacity can be reached, all the observations are connected,
+    - otherwise the observations of a satellite are connected when their windows, extended by the transition time, overlap, as the
+    slot found for one can only depend on the observations placed in that span.
+    The users are shared by all the sub-instances, so the exclusive windows :math:`e_u` and the bidders of the auctions are those
+    of p, and each sub-instance keeps the satellites its observations use. The requests and observations keep their order in p,
+    so solving the components one by one gives the schedule of p with the deterministic solvers.
+    Requests without observation opportunities cannot be scheduled and are left out.
+    """
+    observations = p.observations
+    position = {o.id: i for i, o in enumerate(observations)}
+    parent = list(range(len(observations)))
+    for request in p.requests:
+        for o in request.theta[1:]:
+            _union(parent, position[request.theta[0].id], position[o.id])
+    by_satellite: Dict[int, List[int]] = {}
+    for i, o in enumerate(observations):
+        by_satellite.setdefault(o.s.id, []).append(i)
+    for satid, rows in by_satellite.items():
+        s = observations[rows[0]].s
+        if len(rows) > s.capacity:
+            for i in rows[1:]:
+                _union(parent, rows[0], i)
+            continue
+        # sweep over the windows [t_start, t_end + tau] sorted by start
+        rows.sort(key=lambda i: observations[i].t_start)
+        end = None
+        for previous, i in zip([None] + rows, rows):
+            o = observations[i]
+            if end is not None and o.t_start <= end:
+                _union(parent, previous, i)
+                end = max(end, o.t_end + s.transition_time)
+            else:
+                end = o.t_end + s.transition_time
+    
+    components: Dict[int, Tuple[List, List]] = {}
+    for i, o in enumerate(observations):
+        components.setdefault(_find(parent, i), ([], []))[1].append(o)
+    for request in p.requests:
+        if request.theta:
+            components[_find(parent, position[request.theta[0].id])][0].append(request)
+    sub_instances = []
+    for root in sorted(components):
+        requests, sub_observations = components[root]
+        satids = {o.s.id for o in sub_observations}
+        sub_instances.append(EOSCSP(satellites=[s for s in p.satellites if s.id in satids], users=p.users, requests=requests,
+                                    observations=sub_observations))
+    return sub_instances
+
+
+def _solve_component(solver: Union[str, Callable], sub_p: EOSCSP, kwargs: Dict) -> Dict[int, Tuple[int, float]]:
+    # runs in the worker processes, only the ids and start times of the schedule are sent back
+    solver = SOLVERS[solver] if isinstance(solver, str) else solver
+    schedule = solver(sub_p, **kwargs)[0]
+    return {obsid: (s.id, start) for obsid, (s, start) in schedule.items()}
+
+
+def solve_components(p: EOSCSP, solver: Union[str, Callable] = 'greedy', workers: int = 1, **kwargs) -> Tuple[
+    Dict[int, Tuple[Satellite, float]], float]:
+    """
+    Solve each independent sub-instance of `decompose(p)` with a solver and merge their schedules.
+    :param p: An instance of EOSCSP.
+    :param solver: One of SOLVERS, or a function of an EOSCSP whose result starts with the {obs_id: (satellite, start_time)}
+    schedule (it must be picklable, i.e. defined at module level, to be used with several workers).
+    :param workers: The number of worker processes, None for one per CPU, 1 solves the components in this process.
+    :param kwargs: Passed to the solver.
+    :return: A mapping from each observation to (satellite, start_time), and the total reward.
+    """
+    with instrument.phase('decompose'):
+        sub_instances = decompose(p)
+    instrument.count('components', len(sub_instances))
+    with instrument.phase('components'):
+        if (workers is None or workers > 1) and len(sub_instances) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                schedules = list(executor.map(_solve_component, [solver] * len(sub_instances), sub_instances,
+                                              [kwargs] * len(sub_instances)))
+        else:
+            schedules = [_solve_component(solver, sub_p, kwargs) for sub_p in sub_instances]
+    
+    final_solution = {obsid: (p.satellite(satid), start) for schedule in schedules for obsid, (satid, start) in schedule.items()}
+    total_reward = sum([p.observation(obsid).rho for obsid in final_solution])
+    instrument.report('components', total_reward)
+    return final_solution, total_reward
@@ -0,0 +1,297 @@
+import multiprocessing
+from collections import defaultdict
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection, wait
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import instrument
+from auction import BidCache, BidEngine, try_add
+from eoscsp import EOSCSP, Request, Satellite
+from exclusive import exclusive_subproblem
+from greedy import greedy_eoscsp_solver
+from intervals import SatelliteIntervalIndex
+from session import SolveSession
+from utils import generate_random_esop_instance
+
+
+@dataclass
+class AuctionStats:
+    """
+    Measures of a distributed auction.
+    :param messages: The number of messages of each kind, sent by the auctioneer ('call', 'award', ...) or by the agents ('bid',
+    'plan', ...).
+    :param latencies: The time of each round, from sending the calls to receiving the last bid.
+    :param agent_time: The time each agent spent computing its plan and its bids, by user id.
+    :param time: The wall-clock time of the auction, from sending the first call to the last award.
+    :param requests: The number of requests auctioned.
+    """
+    messages: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    latencies: List[float] = field(default_factory=list)
+    agent_time: Dict[int, float] = field(default_factory=dict)
+    time: float = 0.0
+    requests: int = 0
+    
+    def total_messages(self) -> int:
+        return sum(self.messages.values())
+    
+    def throughput(self) -> float:
+        # requests auctioned per second
+        return self.requests / self.time if self.time > 0 else 0.0
+    
+    def summary(self) -> Dict:
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {'rounds': len(self.latencies), 'messages': self.total_messages(), 'messages_by_kind': dict(self.messages),
+                'latency_mean': float(latencies.mean()), 'latency_p95': float(np.percentile(latencies, 95)),
+                'latency_max': float(latencies.max()), 'time': self.time, 'requests_per_second': self.throughput(),
+                'messages_per_second': self.total_messages() / self.time if self.time > 0 else 0.0,
+                'agent_time': dict(self.agent_time)}
+
+
+def _signature(sig: Tuple) -> Tuple[int, float]:
+    # (observation, start time) of a bid as ids, -1 for a zero bid
+    o, start = sig
+    return (-1, -1.0) if o is None else (o.id, start)
+
+
+def _agent(conn: Connection, p: EOSCSP, userid: int, reqids: List[int], protocol: str):
+    """
+    An exclusive user, run in its own process: it solves P[u], sends its plan to the auctioneer and answers its messages until
+    'stop'. The plan and the bids are computed on the agent's own copy of p, only ids and start times are exchanged.
+    """
+    busy = perf_counter()
+    _, r, _ = greedy_eoscsp_solver(exclusive_subproblem(p, p.user(userid)))
+    plan = [(o.id, start) for timeline in r.values() for o, (_, start) in timeline]
+    requests = [p.request(reqid) for reqid in reqids]
+    cache = None
+    if protocol == 'ssi':
+        cache = BidCache(requests, {userid: r})
+        cache.fill(requests)
+    busy = perf_counter() - busy
+    conn.send(('plan', plan))
+    
+    while True:
+        message = conn.recv()
+        kind = message[0]
+        start = perf_counter()
+        if kind == 'bids':
+            # bids on all the requests at once
+            values, signatures = BidEngine(requests).bids(r)
+            conn.send(('bids', values, [_signature(sig) for sig in signatures]))
+        elif kind == 'call':
+            request = p.request(message[1])
+            value, sig = cache.get(userid, request)
+            cache.done(request)
+            conn.send(('bid', value, _signature(sig)))
+        elif kind == 'award':
+            o = p.observation(message[1])
+            r[o.s.id].add(o, message[2])
+            cache.invalidate(userid, o.s.id)
+        elif kind == 'stop':
+            conn.send(('stats', busy))
+            break
+        busy += perf_counter() - start
+    conn.close()
+
+
+class DistributedAuction:
+    """
+    The auctioneer of an auction among exclusive user agents running in separate processes, linked to it by pipes.
+    The agents are started with `open`, which returns their plans, and stopped with `close`; the class can be used as a context
+    manager. Every message sent or received is counted in `stats`.
+    :param p: An instance of EOSCSP.
+    :param requests: The requests to auction, in order.
+    :param protocol: 'psi' (one round of bids on all the requests) or 'ssi' (one round per request).
+    :param start_method: The multiprocessing start method, the platform default when None.
+    """
+    
+    def __init__(self, p: EOSCSP, requests: List[Request], protocol: str = 'ssi', start_method: str = None):
+        if protocol not in ('psi', 'ssi'):
+            raise ValueError(f"unknown protocol {protocol}, expected 'psi' or 'ssi'")
+        self.p = p
+        self.requests = requests
+        self.protocol = protocol
+        self.context = multiprocessing.get_context(start_method)
+        self.users = [user.id for user in p.users if user.exclusive_times]
+        self.connections: Dict[int, Connection] = {}
+        self.processes = []
+        self.stats = AuctionStats()
+    
+    def open(self) -> Dict[int, List[Tuple[int, float]]]:
+        # start the agents, and receive the (obs id, start time) entries of their plans
+        reqids = [request.id for request in self.requests]
+        for userid in self.users:
+            conn, agent_conn = self.context.Pipe()
+            process = self.context.Process(target=_agent, args=(agent_conn, self.p, userid, reqids, self.protocol), daemon=True)
+            process.start()
+            agent_conn.close()
+            self.connections[userid] = conn
+            self.processes.append(process)
+        return {userid: reply[1] for userid, reply in self.gather(self.users).items()}
+    
+    def send(self, userid: int, message: Tuple):
+        self.connections[userid].send(message)
+        self.stats.messages[message[0]] += 1
+        instrument.count('distributed.messages')
+    
+    def broadcast(self, message: Tuple):
+        for userid in self.users:
+            self.send(userid, message)
+    
+    def gather(self, users: List[int]) -> Dict[int, Tuple]:
+        # one reply of each of the users, in the order of users
+        waiting = {self.connections[userid]: userid for userid in users}
+        replies = {}
+        while waiting:
+            for conn in wait(list(waiting)):
+                reply = conn.recv()
+                replies[waiting.pop(conn)] = reply
+                self.stats.messages[reply[0]] += 1
+                instrument.count('distributed.messages')
+        return {userid: replies[userid] for userid in users}
+    
+    def round(self, message: Tuple) -> Dict[int, Tuple]:
+        # send a message to all the agents and wait for all their replies
+        start = perf_counter()
+        self.broadcast(message)
+        replies = self.gather(self.users)
+        self.stats.latencies.append(perf_counter() - start)
+        return replies
+    
+    def close(self):
+        if not self.processes:
+            return
+        self.broadcast(('stop',))
+        for userid, reply in self.gather(self.users).items():
+            self.stats.agent_time[userid] = reply[1]
+        for process in self.processes:
+            process.join()
+        for conn in self.connections.values():
+            conn.close()
+        self.connections, self.processes = {}, []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            # the agents may not answer anymore
+            for process in self.processes:
+                process.terminate()
+            for conn in self.connections.values():
+                conn.close()
+            self.connections, self.processes = {}, []
+        self.close()
+
+
+def _merge_plans(p: EOSCSP, auction: DistributedAuction, plans: SatelliteIntervalIndex):
+    # the plans of the agents, in the order of psi_solver and ssi_solver
+    for userid, entries in auction.open().items():
+        plans.extend((p.observation(obsid), (p.observation(obsid).s, start)) for obsid, start in entries)
+
+
+def _finish(p: EOSCSP, plans: SatelliteIntervalIndex, requests: List[Request], processed_requests, name: str) -> Tuple[
+    Dict[int, Tuple[Satellite, float]], float]:
+    # schedule the requests left with the greedy algorithm of u0 over the merged plans
+    with instrument.phase(f'{name}.p_u0'):
+        remaining_requests = [req for req in requests if req.id not in processed_requests]
+        obs = [obs for req in remaining_requests for obs in req.theta]
+        p_u0 = EOSCSP(satellites=p.satellites, users=[p.users[0]], requests=remaining_requests, observations=obs)
+        _, r, _ = greedy_eoscsp_solver(p_u0, plans.plan())
+    M = [x for value in r.values() for x in value]
+    total_reward = sum([o.rho for o, _ in M])
+    instrument.report(name, total_reward)
+    return {observation.id: (satellite, start_time) for observation, (satellite, start_time) in M}, total_reward
+
+
+def distributed_psi_solver(p: EOSCSP, start_method: str = None) -> Tuple[Dict[int, Tuple[Satellite, float]], float, AuctionStats]:
+    """
+    PSI with each exclusive user as an agent process: the agents solve their sub problems and bid on all the non-exclusive
+    requests in parallel, in a single round, and the auctioneer merges the bids as psi_solver does.
+    :param p: An instance of EOSCSP.
+    :param start_method: The multiprocessing start method, the platform default when None.
+    :return: A mapping from each observation to (satellite, start_time), the total reward and the AuctionStats.
+    """
+    requests = SolveSession(p).non_exclusive_requests()
+    plans = SatelliteIntervalIndex(p.satellites)
+    with DistributedAuction(p, requests, 'psi', start_method) as auction:
+        with instrument.phase('distributed_psi.agents'):
+            _merge_plans(p, auction, plans)
+        with instrument.phase('distributed_psi.auction'):
+            start = perf_counter()
+            replies = auction.round(('bids',))
+            B_u = [replies[userid][1] for userid in auction.users]
+            sig_u = [replies[userid][2] for userid in auction.users]
+            max_bid = np.max(B_u, axis=0) if B_u else np.zeros(len(requests))
+            b_t = np.transpose(B_u)
+            processed_requests = set()
+            for i, req in enumerate(requests):
+                if max_bid[i] <= 0:
+                    continue
+                w = np.where(b_t[i] == max_bid[i])[0][0]
+                sig = (p.observation(sig_u[w][i][0]), sig_u[w][i][1])
+                added, removed = try_add(plans, sig)
+                if added:
+                    plans.add(sig[0], sig[1])
+                    processed_requests.add(req.id)
+                    for r_id in removed:
+                        processed_requests.discard(r_id)
+            auction.stats.time = perf_counter() - start
+            auction.stats.requests = len(requests)
+    
+    final_solution, total_reward = _finish(p, plans, requests, processed_requests, 'distributed_psi')
+    return final_solution, total_reward, auction.stats
+
+
+def distributed_ssi_solver(p: EOSCSP, seed: int = None, start_method: str = None) -> Tuple[
+    Dict[int, Tuple[Satellite, float]], float, AuctionStats]:
+    """
+    SSI with each exclusive user as an agent process holding its own plan: for each non-exclusive request the auctioneer calls for
+    bids, the agents answer in parallel, and the winner is sent an award and commits the observation to its plan. The agents cache
+    their bids as ssi_solver does, so the result is that of ssi_solver with the same seed.
+    :param p: An instance of EOSCSP.
+    :param seed: Seed of the random choice between equal bids, np.random is used when it is None.
+    :param start_method: The multiprocessing start method, the platform default when None.
+    :return: A mapping from each observation to (satellite, start_time), the total reward and the AuctionStats.
+    """
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    requests = SolveSession(p).non_exclusive_requests()
+    plans = SatelliteIntervalIndex(p.satellites)
+    with DistributedAuction(p, requests, 'ssi', start_method) as auction:
+        with instrument.phase('distributed_ssi.agents'):
+            _merge_plans(p, auction, plans)
+        with instrument.phase('distributed_ssi.auction'):
+            start = perf_counter()
+            processed_requests = set()
+            for request in requests:
+                if not auction.users:
+                    break
+                replies = auction.round(('call', request.id))
+                B_u = [replies[userid][1] for userid in auction.users]
+                max_bid = np.max(B_u)
+                if max_bid <= 0:
+                    continue
+                w = rng.choice(np.where(B_u == max_bid)[0])
+                obsid, t = replies[auction.users[w]][2]
+                sig = (p.observation(obsid), t)
+                added, removed = try_add(plans, sig)
+                if added:
+                    plans.add(sig[0], sig[1])
+                    auction.send(auction.users[w], ('award', obsid, t))
+                    processed_requests.add(request.id)
+                    for r_id in removed:
+                        processed_requests.discard(r_id)
+            auction.stats.time = perf_counter() - start
+            auction.stats.requests = len(requests)
+    
+    final_solution, total_reward = _finish(p, plans, requests, processed_requests, 'distributed_ssi')
+    return final_solution, total_reward, auction.stats
+
+
+if __name__ == '__main__':
+    eoscsp = generate_random_esop_instance(4, 3, 10)
+    schedule, reward, stats = distributed_ssi_solver(eoscsp)
+    print(stats.summary())
+    eoscsp.plot_schedule(schedule)
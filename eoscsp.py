@@ -1,22 +1,54 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass, field
 from itertools import count
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
 from matplotlib.colors import TABLEAU_COLORS
+from matplotlib.figure import Figure
 from matplotlib.patches import Patch
 
-r_counter = count()
-sat_counter = count()
-u_counter = count()
-obs_counter = count()
+
+class IdAllocator:
+    """
+    Numbers the requests, satellites, users and observations of an instance, each kind from 0 in creation order.
+    The allocator in use is held in a context variable, so the threads (or asyncio tasks) building instances inside `id_scope` each
+    number their objects independently, instead of sharing module-level counters.
+    """
+    
+    def __init__(self):
+        self.requests = count()
+        self.satellites = count()
+        self.users = count()
+        self.observations = count()
+
+
+_allocator: ContextVar[IdAllocator] = ContextVar('eoscsp_ids', default=IdAllocator())
+
+
+@contextmanager
+def id_scope(allocator: IdAllocator = None):
+    """
+    Number the objects created in the block with their own allocator:
+
+        with id_scope():
+            p = generate_random_esop_instance(3, 2, 5)
+    """
+    token = _allocator.set(allocator or IdAllocator())
+    try:
+        yield _allocator.get()
+    finally:
+        _allocator.reset(token)
+
 
 def reset_counters():
-    global r_counter, sat_counter, u_counter, obs_counter
-    r_counter = count()
-    sat_counter = count()
-    u_counter = count()
-    obs_counter = count()
+    # number the next objects from 0 again, in the current thread or task only
+    _allocator.set(IdAllocator())
+
 
 @dataclass
 class Request:
@@ -29,7 +61,7 @@ class Request:
     :param u: The identifier of the requester, belonging to the set of users U.
     :param theta: The list of observation opportunities to satisfy the request.
     """
-    id: int = field(default_factory=lambda: next(r_counter), init=False)
+    id: int = field(default_factory=lambda: next(_allocator.get().requests), init=False)
     t_start: float
     t_end: float
     delta: float = field(init=False)
@@ -57,7 +89,7 @@ class Satellite:
     end_time: float
     capacity: int
     transition_time: float
-    id: int = field(default_factory=lambda: next(sat_counter))
+    id: int = field(default_factory=lambda: next(_allocator.get().satellites))
 
 
 @dataclass
@@ -76,7 +108,7 @@ class User:
     """
     exclusive_times: List[Tuple[Satellite, Tuple[float, float]]]  # 独占时间窗口集合
     p: int = field(default=10)  # 优先级
-    id: int = field(default_factory=lambda: next(u_counter))
+    id: int = field(default_factory=lambda: next(_allocator.get().users))
 
 
 @dataclass
@@ -98,7 +130,7 @@ class Observation:
     Therefore, our model can consider different rewards, but in this study, we focus on the case where the observation reward directly
     inherits from the request.
     """
-    id: int = field(default_factory=lambda: next(obs_counter), init=False)
+    id: int = field(default_factory=lambda: next(_allocator.get().observations), init=False)
     i: int
     t_start: float
     t_end: float
@@ -122,64 +154,106 @@ class EOSCSP:
     :param users: The set of users U, containing multiple user objects.
     :param requests: The set of requests R, containing multiple request objects.
     :param observations: The set of observations O, containing multiple observation objects.
+    The objects can be looked up by id with `satellite`, `user`, `request` and `observation`. The tables are built on first use,
+    `reindex` must be called if the lists are modified afterwards.
     """
     satellites: List[Satellite]
     users: List[User]
     requests: List[Request]
     observations: List[Observation]
+    _index: Dict[str, Dict[int, object]] = field(default=None, init=False, repr=False, compare=False)
+    
+    def __getstate__(self):
+        # the tables are rebuilt on demand rather than pickled, e.g. when sent to worker processes
+        state = dict(self.__dict__)
+        state['_index'] = None
+        return state
+    
+    def reindex(self):
+        self._index = {'satellites': {s.id: s for s in self.satellites}, 'users': {u.id: u for u in self.users},
+                       'requests': {r.id: r for r in self.requests}, 'observations': {o.id: o for o in self.observations}}
+    
+    def _lookup(self, kind: str, id: int):
+        if self._index is None:
+            self.reindex()
+        return self._index[kind][id]
+    
+    def satellite(self, satid: int) -> Satellite:
+        return self._lookup('satellites', satid)
+    
+    def user(self, userid: int) -> User:
+        return self._lookup('users', userid)
     
-    def plot_schedule(self, s: Dict[int, Tuple[Satellite, float]] = None):
-        fig, ax = plt.subplots(figsize=(10, 10))
+    def request(self, reqid: int) -> Request:
+        return self._lookup('requests', reqid)
+    
+    def observation(self, obsid: int) -> Observation:
+        return self._lookup('observations', obsid)
+    
+    def plot_schedule(self, s: Dict[int, Tuple[Satellite, float]] = None, path: str = None, max_annotations: Optional[int] = 200):
+        """
+        Plot the observation windows, the scheduled observations of `s` and the exclusive windows of each satellite.
+        The bars are drawn as one collection per kind, so large instances render in seconds.
+        :param s: A schedule {obs_id: (satellite, start_time)}.
+        :param path: Save the figure to this file (the format is given by the extension, e.g. .png or .svg) with the Agg canvas
+        instead of showing it, pyplot is not used so this works on headless servers and in threads.
+        :param max_annotations: Label at most this many observations, spread over the instance (None labels all of them, 0 none).
+        :return: The figure.
+        """
+        if path is None:
+            fig, ax = plt.subplots(figsize=(10, 10))
+        else:
+            fig = Figure(figsize=(10, 10))
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot()
         
         # Generate distinct colors for each user
         colors = list(TABLEAU_COLORS)
         user_colors = {user.id: colors[i % len(colors)] for i, user in enumerate(self.users)}
+        legend_handles = [Patch(color=user_colors[user.id], label=f'User {user.id}') for user in self.users]
+        satellite_index = {satellite.id: i for i, satellite in enumerate(self.satellites)}
         
-        # Create a list for legend handles
-        legend_handles = []
-        for user in self.users:
-            # Add to legend
-            color = user_colors[user.id]
-            handle = Patch(color=color, label=f'User {user.id}')
-            legend_handles.append(handle)
-        
-        # Plotting satellites and their planning periods
-        for i, satellite in enumerate(self.satellites):
-            # ax.broken_barh([(satellite.start_time, satellite.end_time - satellite.start_time)], (i - 0.4, 0.8), facecolors='lightgrey')
-            
-            # Plotting exclusive orbit portions
-            for user in self.users:
-                color = user_colors[user.id]
-                for excl_satellite, (excl_start, excl_end) in user.exclusive_times:
-                    if excl_satellite == satellite:
-                        ax.broken_barh([(excl_start, excl_end - excl_start)], (i - 0.4, 0.8), facecolors='none', edgecolor=color,
-                                       hatch='//')
+        # Plotting exclusive orbit portions
+        windows = [(excl_start, satellite_index[excl_satellite.id] - 0.4, excl_end - excl_start, 0.8, user_colors[user.id])
+                   for user in self.users for excl_satellite, (excl_start, excl_end) in user.exclusive_times
+                   if excl_satellite.id in satellite_index]
+        if windows:
+            ax.add_collection(_bars(windows, facecolors='none', hatch='//'))
         
         # Height offset within each satellite's track for displaying observations
         observation_height_offset = 0.1
         max_observations_per_satellite = max(satellite.capacity for satellite in self.satellites)
         
-        # Plotting observations
+        observation_windows = []
+        scheduled = []
+        heights = []
         for observation in self.observations:
-            satellite_idx = self.satellites.index(observation.s)
             color = user_colors[observation.u.id]
-            height = (satellite_idx - 0.4) + (observation.id % max_observations_per_satellite) * observation_height_offset
-            
+            height = (satellite_index[observation.s.id] - 0.4) + (observation.id % max_observations_per_satellite) * observation_height_offset
             if s and observation.id in s:
                 # Use mapped satellite and start time if available
                 mapped_satellite, mapped_start_time = s[observation.id]
-                mapped_satellite_idx = self.satellites.index(mapped_satellite)
-                height = (mapped_satellite_idx - 0.4) + (observation.id % max_observations_per_satellite) * observation_height_offset
-                ax.broken_barh([(mapped_start_time, observation.delta)], (height, 0.1), facecolors=color)
-            
-            # observation window
-            ax.broken_barh([(observation.t_start, observation.t_end - observation.t_start)], (height, 0.1), facecolors=color, alpha=0.2)
-            
-            # Annotate each observation
+                height = (satellite_index[mapped_satellite.id] - 0.4) + (
+                        observation.id % max_observations_per_satellite) * observation_height_offset
+                scheduled.append((mapped_start_time, height, observation.delta, 0.1, color))
+            observation_windows.append((observation.t_start, height, observation.t_end - observation.t_start, 0.1, color))
+            heights.append(height)
+        if observation_windows:
+            ax.add_collection(_bars(observation_windows, alpha=0.2))
+        if scheduled:
+            ax.add_collection(_bars(scheduled))
+        
+        # Annotate the observations, or an evenly spread sample of them
+        annotated = range(len(self.observations))
+        if max_annotations is not None and len(self.observations) > max_annotations:
+            annotated = np.linspace(0, len(self.observations) - 1, max_annotations, dtype=int) if max_annotations > 0 else []
+        for k in annotated:
+            observation = self.observations[k]
             mid_point = observation.t_start + (observation.t_end - observation.t_start) / 2
-            ax.annotate(f'o_{{{observation.u.id},{observation.request.id},{observation.i}}}', xy=(mid_point, height), xytext=(0, 5),
+            ax.annotate(f'o_{{{observation.u.id},{observation.request.id},{observation.i}}}', xy=(mid_point, heights[k]), xytext=(0, 5),
                         textcoords='offset points', ha='center', va='bottom', fontsize=8, color='black')
         
+        ax.autoscale_view()
         ax.set_xlabel('Time')
         ax.set_ylabel('Satellites')
         ax.set_yticks(range(len(self.satellites)))
@@ -189,4 +263,19 @@ class EOSCSP:
         # Adding the legend to the plot
         ax.legend(handles=legend_handles, loc='upper right')
         
-        plt.show()
+        if path is None:
+            plt.show()
+        else:
+            fig.savefig(path)
+        return fig
+
+
+def _bars(bars: List[Tuple[float, float, float, float, str]], **kwargs) -> PolyCollection:
+    # one collection of the (x, y, width, height, color) rectangles, the colors are the face colors unless facecolors is given
+    x, y, width, height = (np.array([bar[k] for bar in bars], dtype=float) for k in range(4))
+    vertices = np.stack([np.stack([x, y], axis=1), np.stack([x, y + height], axis=1), np.stack([x + width, y + height], axis=1),
+                         np.stack([x + width, y], axis=1)], axis=1)
+    colors = [bar[4] for bar in bars]
+    if 'facecolors' in kwargs:
+        return PolyCollection(vertices, edgecolors=colors, **kwargs)
+    return PolyCollection(vertices, facecolors=colors, **kwargs)
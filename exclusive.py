@@ -0,0 +1,68 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import instrument
+from eoscsp import EOSCSP, Observation, Request, Satellite, User
+from greedy import greedy_eoscsp_solver
+from timeline import Timeline
+
+
+def group_by_user(p: EOSCSP) -> Tuple[Dict[int, List[Request]], Dict[int, List[Observation]]]:
+    # the requests and the observations of each user, in the order of p
+    requests = defaultdict(list)
+    for r in p.requests:
+        requests[r.u.id].append(r)
+    observations = defaultdict(list)
+    for o in p.observations:
+        observations[o.u.id].append(o)
+    return requests, observations
+
+
+def exclusive_subproblem(p: EOSCSP, user: User, groups: Tuple[Dict[int, List[Request]], Dict[int, List[Observation]]] = None) -> \
+        EOSCSP:
+    # the sub problem P[u] only has the requests and observations of user u, taken from the groups of group_by_user when given
+    if groups is None:
+        return EOSCSP(satellites=p.satellites, users=[user], requests=[r for r in p.requests if r.u.id == user.id],
+                      observations=[o for o in p.observations if o.u.id == user.id])
+    requests, observations = groups
+    return EOSCSP(satellites=p.satellites, users=[user], requests=list(requests.get(user.id, [])),
+                  observations=list(observations.get(user.id, [])))
+
+
+def _solve_subproblem(sub_p: EOSCSP) -> Dict[int, float]:
+    # runs in the worker processes, only the start time of each scheduled observation is sent back
+    m, _, _ = greedy_eoscsp_solver(sub_p)
+    return {obsid: start for obsid, (_, start) in m.items()}
+
+
+def solve_exclusive_users(p: EOSCSP, workers: int = 1, groups: Tuple[Dict[int, List[Request]], Dict[int, List[Observation]]] = None) -> \
+        Dict[int, Tuple[Dict[int, Tuple[Satellite, float]], Dict[int, Timeline], float]]:
+    """
+    The exclusive-user phase shared by the decentralized solvers: solve P[u] with the greedy algorithm for each exclusive user.
+    The sub problems are independent, with more than one worker they are solved in a process pool. The plans are rebuilt on the
+    objects of p, so the result does not depend on the number of workers.
+    :param p: An instance of EOSCSP.
+    :param workers: The number of worker processes, None for one per CPU, 1 solves the sub problems in this process.
+    :param groups: The requests and observations of each user as returned by group_by_user, e.g. those cached by a SolveSession,
+    computed when not given.
+    :return: The greedy (m, r, total_reward) of each exclusive user, by user id.
+    """
+    with instrument.phase('exclusive_users'):
+        users = [user for user in p.users if user.exclusive_times]
+        groups = groups or group_by_user(p)
+        sub_problems = [exclusive_subproblem(p, user, groups) for user in users]
+        if (workers is None or workers > 1) and len(sub_problems) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                starts = list(executor.map(_solve_subproblem, sub_problems))
+            return {user.id: _rebuild(sub_p, start) for user, sub_p, start in zip(users, sub_problems, starts)}
+        return {user.id: greedy_eoscsp_solver(sub_p) for user, sub_p in zip(users, sub_problems)}
+
+
+def _rebuild(sub_p: EOSCSP, starts: Dict[int, float]) -> Tuple[Dict[int, Tuple[Satellite, float]], Dict[int, Timeline], float]:
+    m = {obsid: (sub_p.observation(obsid).s, start) for obsid, start in starts.items()}
+    entries: Dict[int, List] = {s.id: [] for s in sub_p.satellites}
+    for obsid, (s, start) in m.items():
+        entries[s.id].append((sub_p.observation(obsid), (s, start)))
+    r = {s.id: Timeline(s, entries[s.id]) for s in sub_p.satellites}
+    return m, r, sum([o.rho for value in r.values() for o, _ in value])
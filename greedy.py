@@ -1,61 +1,59 @@
-from typing import Dict, List, Optional, Tuple
+from heapq import heapify, heappop
+from typing import Dict, Optional, Tuple
 
+import instrument
 from eoscsp import EOSCSP, Observation, Satellite
+from timeline import Timeline, UndoLog, make_plan
 from utils import generate_random_esop_instance
 
 
-def first_slot(observation: Observation, R: Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]]) -> Optional[
+def first_slot(observation: Observation, R: Dict[int, Timeline], probe: bool = False, log: UndoLog = None) -> Optional[
     Tuple[Satellite, float]]:
+    """
+    Find the earliest slot for the observation in the plan R and insert it there.
+    :param probe: Only check feasibility, the plan is left untouched.
+    :param log: Record the insertion so that it can be rolled back with `log.rollback`.
+    :return: The (satellite, start_time) of the slot, or None if the observation cannot be scheduled.
+    """
     s = observation.s
-    if len(R[s.id]) < s.capacity:
-        if not R[s.id]:  # R[s.id] is empty
-            if observation.t_end >= observation.t_start + observation.delta:
-                R[s.id].append((observation, (s, observation.t_start)))
-                return s, observation.t_start
-        else:
-            for i in range(len(R[s.id]) + 1):
-                t_start_prime = observation.t_start
-                if i > 0:
-                    obs_prev, (_, t_prev_start) = R[s.id][i - 1]
-                    t_start_prime = max(observation.t_start, t_prev_start + obs_prev.delta + s.transition_time)
-                if t_start_prime + observation.delta <= observation.t_end:
-                    if i == len(R[s.id]):
-                        t_upper = observation.t_end
-                        t_end_prime = t_start_prime + observation.delta
-                    else:
-                        o_i, (s_i, t_next_start) = R[s.id][i]
-                        t_upper = t_next_start
-                        t_end_prime = t_start_prime + observation.delta + s.transition_time
-                    if t_start_prime < t_end_prime <= t_upper:
-                        R[s.id].insert(i, (observation, (s, t_start_prime)))
-                        return s, t_start_prime
-    return None
+    instrument.count('first_slot.calls')
+    slot = R[s.id].find_slot(observation)
+    if slot is None:
+        return None
+    instrument.count('first_slot.success')
+    i, t_start_prime = slot
+    if not probe:
+        R[s.id].insert(i, observation, t_start_prime)
+        if log is not None:
+            log.record(R[s.id], i)
+    return s, t_start_prime
 
 
-def greedy_eoscsp_solver(p: EOSCSP, r=None) -> Tuple[
-    Dict[int, Tuple[Satellite, float]], Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]],float]:
+def greedy_eoscsp_solver(p: EOSCSP, r=None) -> Tuple[Dict[int, Tuple[Satellite, float]], Dict[int, Timeline], float]:
     # mapping from observation to (satellite, start_time)
     m = {}
-    sorted_observations = sorted(p.observations, key=lambda obs: (obs.p, obs.t_start))
-    # r[s.id] = [(o, (s, t_start))]
-    if r is None:
-        r = {s.id: [] for s in p.satellites}
+    # priority queue on (p, t_start), the position in p.observations keeps ties in the original order
+    queue = [(obs.p, obs.t_start, i, obs) for i, obs in enumerate(p.observations)]
+    heapify(queue)
+    # r[s.id] = Timeline of [(o, (s, t_start))]
+    r = make_plan(p.satellites, r)
+    # requests already served, their remaining observation opportunities are skipped
+    satisfied = set()
     
-    while sorted_observations:
-        o = sorted_observations[0]  # Always work with the first element
-        t = first_slot(o, r)
-        if t is not None:
-            m[o.id] = t
-            # Remove the observation opportunities of the same request
-            sorted_observations = [obs for obs in sorted_observations if obs.request != o.request]
-        else:
-            # Move to the next observation if no slot is found
-            sorted_observations.pop(0)
+    with instrument.phase('greedy'):
+        while queue:
+            o = heappop(queue)[-1]
+            if o.request.id in satisfied:
+                continue
+            t = first_slot(o, r)
+            if t is not None:
+                m[o.id] = t
+                satisfied.add(o.request.id)
     
     M = [x for value in r.values() for x in value]
     # Calculate total reward
     total_reward = sum([o.rho for o, _ in M])
-    print("Reward of greedy: ", total_reward)
+    instrument.report('greedy', total_reward)
     return m, r, total_reward
 
 
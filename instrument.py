@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import Dict
+
+# print the rewards reported by the solvers, as the solvers used to do
+VERBOSE = True
+
+# the active Recorder, None when instrumentation is disabled
+recorder = None
+
+_disabled = nullcontext()
+
+
+class Recorder:
+    """
+    Per-phase timers, counters and solver rewards recorded while instrumentation is enabled, see `recording`.
+    Each phase also produces a complete event, so the run can be exported as a Chrome trace (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.phases: Dict[str, Dict[str, float]] = defaultdict(lambda: {'calls': 0, 'time': 0.0})
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.rewards = []
+        self.events = []
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            end = perf_counter()
+            self.phases[name]['calls'] += 1
+            self.phases[name]['time'] += end - start
+            self.events.append((name, start - self.start, end - start, threading.get_ident()))
+
+    def to_dict(self) -> Dict:
+        return {'phases': dict(self.phases), 'counters': dict(self.counters), 'rewards': self.rewards,
+                'events': [{'name': name, 'start': start, 'duration': duration} for name, start, duration, _ in self.events]}
+
+    def to_chrome_trace(self) -> Dict:
+        pid = os.getpid()
+        events = [{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6, 'pid': pid, 'tid': tid}
+                  for name, start, duration, tid in self.events]
+        end = (perf_counter() - self.start) * 1e6
+        events.extend({'name': name, 'ph': 'C', 'ts': end, 'pid': pid, 'args': {name: value}} for name, value in self.counters.items())
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path: str, chrome: bool = None):
+        # chrome trace-event format for *.trace.json files unless chrome is given
+        if chrome is None:
+            chrome = path.endswith('.trace.json')
+        with open(path, 'w') as file:
+            json.dump(self.to_chrome_trace() if chrome else self.to_dict(), file, indent=1)
+
+
+@contextmanager
+def recording():
+    """
+    Enable instrumentation for the duration of the block:
+
+        with recording() as rec:
+            psi_solver(p)
+        rec.save('psi.trace.json')
+    """
+    global recorder
+    previous, recorder = recorder, Recorder()
+    try:
+        yield recorder
+    finally:
+        recorder = previous
+
+
+def phase(name: str):
+    # time a phase of a solver, a no-op context when instrumentation is disabled
+    if recorder is None:
+        return _disabled
+    return recorder.phase(name)
+
+
+def count(name: str, n: int = 1):
+    if recorder is not None:
+        recorder.counters[name] += n
+
+
+def report(solver: str, reward: float):
+    # final reward of a solver
+    if recorder is not None:
+        recorder.rewards.append({'solver': solver, 'reward': reward, 'time': perf_counter() - recorder.start})
+    if VERBOSE:
+        print(f"Reward of {solver}: ", reward)
@@ -0,0 +1,121 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from heapq import heappop, heappush
+from typing import Dict, Iterable, List, Tuple
+
+from eoscsp import Observation, Satellite, User
+
+
+class ExclusiveIndex:
+    """
+    Interval index over the exclusive windows :math:`e_u` of the users, per satellite.
+    The windows of a satellite are sorted by start time, together with the running maximum of their end times, so the windows
+    overlapping a time interval are found with two binary searches.
+    """
+    
+    def __init__(self, users: List[User]):
+        windows = defaultdict(list)
+        self.exclusive_users = set()
+        for user in users:
+            for sat, (start, end) in user.exclusive_times:
+                windows[sat.id].append((start, end, user.id))
+                self.exclusive_users.add(user.id)
+        self.windows = {}
+        self.starts = {}
+        self.max_ends = {}
+        for satid, sat_windows in windows.items():
+            sat_windows.sort()
+            self.windows[satid] = sat_windows
+            self.starts[satid] = [start for start, _, _ in sat_windows]
+            max_ends = []
+            for _, end, _ in sat_windows:
+                max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+            self.max_ends[satid] = max_ends
+    
+    def owners(self, satid: int, t_start: float, t_end: float) -> List[int]:
+        # ids of the users with a window on the satellite overlapping ]t_start, t_end[
+        if satid not in self.windows:
+            return []
+        windows = self.windows[satid]
+        # windows before lo all end before t_start, windows from hi on all start after t_end
+        lo = bisect_right(self.max_ends[satid], t_start)
+        hi = bisect_left(self.starts[satid], t_end)
+        return [userid for start, end, userid in windows[lo:hi] if end > t_start]
+    
+    def allowed(self, o: Observation, start: float) -> bool:
+        """
+        The exclusivity rule shared by the solvers and `schedule.validate_schedule`: an observation of an exclusive user cannot enter
+        the window of another user, an observation of a user without windows (:math:`u_0`) can be anywhere, the auctions give it
+        to the owner of the window.
+        """
+        if o.u.id not in self.exclusive_users:
+            return True
+        return all(userid == o.u.id for userid in self.owners(o.s.id, start, start + o.delta))
+
+
+class SatelliteIntervalIndex:
+    """
+    The merged plan of the PSI/SSI auctions, indexed per satellite: the scheduled (observation, start) entries of each satellite
+    are kept sorted by start time, so the entries overlapping an interval are found by binary search among the entries starting
+    less than the longest duration before it.
+    The longest duration of the entries in the index is kept in a lazy max-heap, so it goes down again when long observations
+    are removed. Insertion and removal shift the sorted Python lists, which is linear but a single memmove; a balanced tree is
+    not in the standard library, and the queries, which dominate try_add, are logarithmic plus the entries returned.
+    Each entry also keeps its insertion number, which gives the order of the previous flat plan list.
+    """
+    
+    def __init__(self, satellites: List[Satellite]):
+        self.satellites = {s.id: s for s in satellites}
+        self.starts = {s.id: [] for s in satellites}
+        self.entries = {s.id: [] for s in satellites}
+        self.max_delta = {s.id: 0.0 for s in satellites}
+        # negated durations of the entries of each satellite, and the number of entries of each duration
+        self.deltas = {s.id: [] for s in satellites}
+        self.delta_counts = {s.id: defaultdict(int) for s in satellites}
+        self.added = 0
+    
+    def __len__(self):
+        return sum(len(entries) for entries in self.entries.values())
+    
+    def add(self, observation: Observation, start: float):
+        satid = observation.s.id
+        i = bisect_right(self.starts[satid], start)
+        self.starts[satid].insert(i, start)
+        self.entries[satid].insert(i, (self.added, observation, start))
+        if not self.delta_counts[satid][observation.delta]:
+            heappush(self.deltas[satid], -observation.delta)
+        self.delta_counts[satid][observation.delta] += 1
+        self.max_delta[satid] = max(self.max_delta[satid], observation.delta)
+        self.added += 1
+    
+    def extend(self, entries: Iterable[Tuple[Observation, Tuple[Satellite, float]]]):
+        for observation, (_, start) in entries:
+            self.add(observation, start)
+    
+    def overlapping(self, satid: int, start: float, end: float) -> List[Tuple[int, Observation, float]]:
+        # entries of the satellite whose [start, start + delta] intersects [start, end], in insertion order
+        starts = self.starts[satid]
+        lo = bisect_left(starts, start - self.max_delta[satid] - 1e-9)
+        hi = bisect_right(starts, end)
+        found = [entry for entry in self.entries[satid][lo:hi] if
+                 (entry[2] <= start <= entry[2] + entry[1].delta) or (start <= entry[2] <= end)]
+        found.sort(key=lambda entry: entry[0])
+        return found
+    
+    def remove(self, entry: Tuple[int, Observation, float]):
+        _, observation, start = entry
+        satid = observation.s.id
+        i = bisect_left(self.starts[satid], start)
+        while self.entries[satid][i] is not entry:
+            i += 1
+        del self.starts[satid][i]
+        del self.entries[satid][i]
+        counts, deltas = self.delta_counts[satid], self.deltas[satid]
+        counts[observation.delta] -= 1
+        while deltas and not counts[-deltas[0]]:
+            del counts[-heappop(deltas)]
+        self.max_delta[satid] = -deltas[0] if deltas else 0.0
+    
+    def plan(self) -> Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]]:
+        # R[s.id] = [(o, (s, t_start))] sorted by start time
+        return {satid: [(o, (self.satellites[satid], t)) for _, o, t in entries] for satid, entries in self.entries.items()}
@@ -0,0 +1,237 @@
+from bisect import bisect_left, bisect_right
+from time import perf_counter
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+import instrument
+from eoscsp import EOSCSP, Observation, Request, Satellite
+from intervals import ExclusiveIndex
+from timeline import Timeline, UndoLog, copy_plan, make_plan
+
+MOVES = ('swap', 'relocate', 'evict')
+
+
+class LocalSearch:
+    r"""
+    Anytime improvement of a schedule of an EOSCSP by local search.
+    Unscheduled requests are first inserted where they fit, then random moves are tried until the budget runs out:
+    - swap: serve a scheduled request with another of its observation opportunities of higher reward,
+    - relocate: move a scheduled request to an opportunity on another satellite, and fill the freed satellite with unscheduled
+    requests,
+    - evict: schedule an unscheduled request by removing at most two cheaper observations around its opportunity, and reinsert
+    them elsewhere.
+    A move is tried on the plan with an UndoLog and kept only if it does not lower the reward, so the current plan is always the
+    best one found. Observations are placed with `Timeline.find_slot` (capacity and transition time), and never in an exclusive
+    window of another user than their owner.
+    :param p: An instance of EOSCSP.
+    :param schedule: The schedule to improve, as the {obs_id: (satellite, start_time)} mapping returned by the solvers, or as a plan
+    `R[s.id]`. It is not modified.
+    :param seed: Seed of the choice of the moves.
+    """
+    
+    def __init__(self, p: EOSCSP, schedule: Union[Dict[int, Tuple[Satellite, float]], Dict[int, Timeline]], seed: int = None):
+        self.p = p
+        self.rng = np.random.RandomState(seed)
+        self.exclusive = ExclusiveIndex(p.users)
+        if all(isinstance(value, Timeline) for value in schedule.values()):
+            self.R = copy_plan(make_plan(p.satellites, schedule))
+        else:
+            entries = {s.id: [] for s in p.satellites}
+            for obsid, (s, start) in schedule.items():
+                entries[s.id].append((p.observation(obsid), (s, start)))
+            self.R = make_plan(p.satellites, entries)
+        # request id -> (observation, start) of the scheduled requests
+        self.scheduled: Dict[int, Tuple[Observation, float]] = {}
+        self.reward = 0.0
+        for timeline in self.R.values():
+            for o, (_, start) in timeline:
+                self.scheduled.setdefault(o.request.id, (o, start))
+                self.reward += o.rho
+        self.requests = {r.id: r for r in p.requests if r.theta}
+        # satellite id -> {observation id: observation} of the opportunities of unscheduled requests
+        self.pending: Dict[int, Dict[int, Observation]] = {s.id: {} for s in p.satellites}
+        for request in self.requests.values():
+            if request.id not in self.scheduled:
+                self._set_pending(request)
+    
+    def schedule(self) -> Dict[int, Tuple[Satellite, float]]:
+        return {o.id: (o.s, start) for timeline in self.R.values() for o, (_, start) in timeline}
+    
+    def _set_pending(self, request: Request):
+        for o in request.theta:
+            self.pending[o.s.id][o.id] = o
+    
+    def _clear_pending(self, request: Request):
+        for o in request.theta:
+            self.pending[o.s.id].pop(o.id, None)
+    
+    def _place(self, o: Observation, log: UndoLog) -> Optional[float]:
+        timeline = self.R[o.s.id]
+        slot = timeline.find_slot(o)
+        if slot is None or not self.exclusive.allowed(o, slot[1]):
+            return None
+        timeline.insert(slot[0], o, slot[1])
+        log.record(timeline, slot[0])
+        return slot[1]
+    
+    def _unplace(self, o: Observation, start: float, log: UndoLog):
+        timeline = self.R[o.s.id]
+        i = timeline.index(o, start)
+        log.record_removal(timeline, i, timeline.pop(i))
+    
+    def _place_request(self, request: Request, log: UndoLog, added: Dict[int, Tuple[Observation, float]],
+                       satid: int = None) -> bool:
+        # serve the request with its best opportunity that fits, only those on satid if it is given
+        for o in sorted(request.theta, key=lambda obs: (-obs.rho, obs.t_start)):
+            if satid is not None and o.s.id != satid:
+                continue
+            start = self._place(o, log)
+            if start is not None:
+                added[request.id] = (o, start)
+                return True
+        return False
+    
+    def _fill(self, satid: int, log: UndoLog, added: Dict[int, Tuple[Observation, float]]):
+        # schedule the unscheduled requests that have an opportunity on the satellite, best reward first
+        for o in sorted(self.pending[satid].values(), key=lambda obs: (-obs.rho, obs.t_start, obs.id)):
+            if o.request.id not in added:
+                self._place_request(o.request, log, added, satid)
+    
+    def _commit(self, log: UndoLog, removed: Dict[int, Tuple[Observation, float]], added: Dict[int, Tuple[Observation, float]],
+                strict: bool = False) -> bool:
+        # keep the changes logged since the trial began if they do not lower the reward, roll them back otherwise
+        gain = sum(o.rho for o, _ in added.values()) - sum(o.rho for o, _ in removed.values())
+        if gain < 0 or (strict and gain == 0) or not (added or removed):
+            log.rollback()
+            return False
+        for reqid in removed:
+            del self.scheduled[reqid]
+            self._set_pending(self.requests[reqid])
+        for reqid, (o, start) in added.items():
+            self.scheduled[reqid] = (o, start)
+            self._clear_pending(o.request)
+        self.reward += gain
+        return True
+    
+    def insert_all(self, deadline: float = None) -> int:
+        # schedule the unscheduled requests that fit without moving anything, best reward first, until the perf_counter deadline
+        log = UndoLog()
+        added = {}
+        for request in sorted(self.requests.values(), key=lambda r: -max(o.rho for o in r.theta)):
+            if deadline is not None and perf_counter() >= deadline:
+                break
+            if request.id not in self.scheduled:
+                self._place_request(request, log, added)
+        self._commit(log, {}, added, strict=True)
+        return len(added)
+    
+    def swap(self, request: Request) -> bool:
+        if request.id not in self.scheduled or len(request.theta) < 2:
+            return False
+        o, start = self.scheduled[request.id]
+        log = UndoLog()
+        removed, added = {request.id: (o, start)}, {}
+        self._unplace(o, start, log)
+        for alternative in sorted(request.theta, key=lambda obs: (-obs.rho, obs.t_start)):
+            if alternative.rho <= o.rho:
+                break
+            t = self._place(alternative, log)
+            if t is not None:
+                added[request.id] = (alternative, t)
+                break
+        return self._commit(log, removed, added, strict=True)
+    
+    def relocate(self, request: Request) -> bool:
+        if request.id not in self.scheduled:
+            return False
+        o, start = self.scheduled[request.id]
+        alternatives = [x for x in request.theta if x.s.id != o.s.id and x.rho >= o.rho]
+        if not alternatives:
+            return False
+        log = UndoLog()
+        removed, added = {request.id: (o, start)}, {}
+        self._unplace(o, start, log)
+        alternative = alternatives[self.rng.randint(len(alternatives))]
+        t = self._place(alternative, log)
+        if t is None:
+            log.rollback()
+            return False
+        added[request.id] = (alternative, t)
+        self._fill(o.s.id, log, added)
+        return self._commit(log, removed, added)
+    
+    def evict(self, request: Request) -> bool:
+        if request.id in self.scheduled:
+            return False
+        o = request.theta[self.rng.randint(len(request.theta))]
+        timeline = self.R[o.s.id]
+        # the observations that can be in the way: those starting before the window of o ends, plus the transition time, and ending,
+        # plus the transition time, after it starts; of those starting before the window only the last one can still be running
+        tau = timeline.satellite.transition_time
+        lo = max(bisect_right(timeline.starts, o.t_start) - 1, 0)
+        hi = bisect_left(timeline.starts, o.t_end + tau)
+        candidates = [entry for entry, free_after in zip(timeline.entries[lo:hi], timeline.free_after[lo:hi])
+                      if free_after > o.t_start][:2]
+        if not candidates or sum(x.rho for x, _ in candidates) >= o.rho:
+            return False
+        log = UndoLog()
+        removed, added = {}, {}
+        for x, (_, start) in candidates:
+            removed[x.request.id] = (x, start)
+            self._unplace(x, start, log)
+        t = self._place(o, log)
+        if t is None:
+            log.rollback()
+            return False
+        added[request.id] = (o, t)
+        for x, _ in candidates:
+            self._place_request(x.request, log, added)
+        self._fill(o.s.id, log, added)
+        return self._commit(log, removed, added, strict=True)
+    
+    def run(self, time_budget: float = None, max_iterations: int = None) -> int:
+        """
+        Improve the plan until the time or iteration budget is spent.
+        :param time_budget: Wall-clock budget in seconds.
+        :param max_iterations: Number of moves to try.
+        :return: The number of moves that were kept.
+        """
+        if time_budget is None and max_iterations is None:
+            raise ValueError('a time or iteration budget is needed')
+        deadline = perf_counter() + time_budget if time_budget is not None else None
+        requests = list(self.requests.values())
+        moves = {'swap': self.swap, 'relocate': self.relocate, 'evict': self.evict}
+        kept = 0
+        with instrument.phase('local_search'):
+            if self.insert_all(deadline):
+                kept += 1
+            iteration = 0
+            while requests:
+                if max_iterations is not None and iteration >= max_iterations:
+                    break
+                if deadline is not None and perf_counter() >= deadline:
+                    break
+                iteration += 1
+                move = MOVES[self.rng.randint(len(MOVES))]
+                if moves[move](requests[self.rng.randint(len(requests))]):
+                    instrument.count(f'local_search.{move}')
+                    kept += 1
+        return kept
+
+
+def improve_schedule(p: EOSCSP, schedule: Union[Dict[int, Tuple[Satellite, float]], Dict[int, Timeline]], time_budget: float = None,
+                     max_iterations: int = None, seed: int = None) -> Tuple[
+    Dict[int, Tuple[Satellite, float]], Dict[int, Timeline], float]:
+    """
+    Improve the schedule returned by any of the solvers with LocalSearch, within a wall-clock and/or iteration budget:
+        
+        m, r, _ = greedy_eoscsp_solver(p)
+        m, r, reward = improve_schedule(p, m, time_budget=1.0)
+    
+    :return: The best (m, r, total_reward) found, as returned by greedy_eoscsp_solver.
+    """
+    search = LocalSearch(p, schedule, seed)
+    search.run(time_budget, max_iterations)
+    instrument.report('local_search', search.reward)
+    return search.schedule(), search.R, search.reward
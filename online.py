@@ -0,0 +1,124 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from eoscsp import EOSCSP, Observation, Request, Satellite
+from greedy import first_slot
+from timeline import Timeline, make_plan
+
+
+@dataclass
+class PlanDelta:
+    """
+    The change made to the plan by an event of the IncrementalScheduler.
+    :param added: The observations scheduled by the event, mapped to their (satellite, start_time).
+    :param removed: The observations unscheduled by the event, mapped to the (satellite, start_time) they had.
+    :param reward: The change of the total reward.
+    """
+    added: Dict[int, Tuple[Satellite, float]] = field(default_factory=dict)
+    removed: Dict[int, Tuple[Satellite, float]] = field(default_factory=dict)
+    reward: float = 0.0
+    
+    def __bool__(self):
+        return bool(self.added or self.removed)
+
+
+class IncrementalScheduler:
+    r"""
+    Online scheduling on top of the greedy plan `R`: requests are added and cancelled one at a time against the current plan,
+    with the `first_slot` semantics, instead of solving the whole instance again.
+    A request that cannot be scheduled when it arrives stays pending. When a cancellation frees a slot, the pending requests
+    with an observation opportunity on that satellite are tried again (in the greedy (p, t_start) order), so the work of an event
+    only depends on the timeline of the satellites it touches.
+    :param satellites: The satellites S.
+    :param r: An existing plan to start from, e.g. the `r` returned by greedy_eoscsp_solver.
+    """
+    
+    def __init__(self, satellites: List[Satellite], r: Dict[int, Timeline] = None):
+        self.R = make_plan(satellites, r)
+        self.requests: Dict[int, Request] = {}
+        # request id -> (observation, start) of the scheduled requests
+        self.scheduled: Dict[int, Tuple[Observation, float]] = {}
+        # satellite id -> {observation id: observation} of the opportunities of pending requests
+        self.pending: Dict[int, Dict[int, Observation]] = {s.id: {} for s in satellites}
+        self.reward = 0.0
+        for timeline in self.R.values():
+            for o, (_, start) in timeline:
+                self.requests[o.request.id] = o.request
+                self.scheduled[o.request.id] = (o, start)
+                self.reward += o.rho
+    
+    @classmethod
+    def from_solution(cls, p: EOSCSP, r: Dict[int, Timeline]) -> 'IncrementalScheduler':
+        # continue from a solution of p, its unscheduled requests become pending
+        scheduler = cls(p.satellites, r)
+        for request in p.requests:
+            if request.id not in scheduler.scheduled:
+                scheduler.requests[request.id] = request
+                scheduler._set_pending(request)
+        return scheduler
+    
+    def schedule(self) -> Dict[int, Tuple[Satellite, float]]:
+        # mapping from observation to (satellite, start_time)
+        return {o.id: (o.s, start) for o, start in self.scheduled.values()}
+    
+    def _set_pending(self, request: Request):
+        for o in request.theta:
+            self.pending[o.s.id][o.id] = o
+    
+    def _clear_pending(self, request: Request):
+        for o in request.theta:
+            self.pending[o.s.id].pop(o.id, None)
+    
+    def _place(self, request: Request, observations: List[Observation], delta: PlanDelta) -> bool:
+        for o in sorted(observations, key=lambda obs: (obs.p, obs.t_start)):
+            t = first_slot(o, self.R)
+            if t is not None:
+                self.scheduled[request.id] = (o, t[1])
+                self.reward += o.rho
+                delta.added[o.id] = t
+                delta.reward += o.rho
+                return True
+        return False
+    
+    def add_request(self, request: Request) -> PlanDelta:
+        """
+        Schedule a new request in the earliest slot of its first feasible observation opportunity, or keep it pending.
+        """
+        if request.id in self.requests:
+            raise ValueError(f'request {request.id} is already known')
+        self.requests[request.id] = request
+        delta = PlanDelta()
+        if not self._place(request, request.theta, delta):
+            self._set_pending(request)
+        return delta
+    
+    def cancel_request(self, request_id: int, repair: bool = True) -> PlanDelta:
+        """
+        Withdraw a request and free its slot.
+        :param repair: Try to schedule the pending requests that have an observation opportunity on the freed satellite.
+        """
+        if request_id not in self.requests:
+            raise ValueError(f'request {request_id} is not known')
+        request = self.requests.pop(request_id)
+        delta = PlanDelta()
+        if request_id not in self.scheduled:
+            self._clear_pending(request)
+            return delta
+        o, start = self.scheduled.pop(request_id)
+        self.R[o.s.id].remove(o, start)
+        self.reward -= o.rho
+        delta.removed[o.id] = (o.s, start)
+        delta.reward -= o.rho
+        if repair:
+            self.repair(o.s.id, delta)
+        return delta
+    
+    def repair(self, satid: int, delta: PlanDelta = None) -> PlanDelta:
+        # schedule pending requests on a satellite, in the greedy (p, t_start) order of their opportunities there
+        delta = delta if delta is not None else PlanDelta()
+        for o in sorted(self.pending[satid].values(), key=lambda obs: (obs.p, obs.t_start, obs.id)):
+            if o.request.id in self.scheduled or o.id not in self.pending[satid]:
+                continue
+            if self._place(o.request, [o], delta):
+                self._clear_pending(o.request)
+        return delta
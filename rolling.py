@@ -0,0 +1,120 @@
+from math import floor
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import instrument
+from eoscsp import Observation, Satellite
+from timeline import Timeline
+
+
+class RollingHorizonPlanner:
+    r"""
+    Streaming greedy planner over a long horizon: the observations are consumed in order of start time, and planned one window
+    :math:`[a, a + W[` at a time, the windows moving forward by :math:`W - overlap`.
+    When a window closes, its observations are placed in the greedy (p, t_start) order, each in its earliest slot after the start of
+    the window (`Timeline.find_slot`). The slots starting before the next window are committed and emitted as a schedule segment,
+    the slots in the overlap are given back to be planned again with the observations of the next window.
+    Only the current window is kept: the observations that can still start in it, the last committed observation of each satellite
+    (for the transition time), the number of committed observations of each satellite (for the capacity), and the served requests
+    that still have opportunities to come. Memory is bounded by the window, not by the horizon.
+    :param satellites: The satellites S.
+    :param window: The duration W of a window.
+    :param overlap: The part of a window planned again with the next one, :math:`0 \le overlap < W`.
+    """
+    
+    def __init__(self, satellites: List[Satellite], window: float, overlap: float = 0.0):
+        if not 0 <= overlap < window:
+            raise ValueError(f'the overlap must be in [0, {window}[, got {overlap}')
+        self.window = window
+        self.step = window - overlap
+        self.start = None
+        self.now = None
+        # the last committed observation of each satellite, and the number of the others
+        self.R = {s.id: Timeline(s) for s in satellites}
+        self.committed = {s.id: 0 for s in satellites}
+        self.kept = {s.id: 0 for s in satellites}
+        # observations to plan, in arrival order
+        self.buffer: List[Observation] = []
+        # request id -> last start time of its opportunities, of the requests served by a committed observation
+        self.served: Dict[int, float] = {}
+        self.reward = 0.0
+    
+    def push(self, o: Observation) -> List[Dict[int, Tuple[Satellite, float]]]:
+        """
+        Add the next observation of the stream.
+        :return: The schedule segments of the windows it closed.
+        """
+        if self.now is not None and o.t_start < self.now:
+            raise ValueError(f'observation {o.id} starts at {o.t_start}, before the previous one ({self.now})')
+        self.now = o.t_start
+        if self.start is None:
+            self.start = o.t_start
+        segments = []
+        while o.t_start >= self.start + self.window:
+            if not self.buffer:
+                # skip the empty windows
+                self.start += self.step * (floor((o.t_start - self.start - self.window) / self.step) + 1)
+                break
+            segments.append(self._close(self.start + self.step))
+            self.start += self.step
+        if o.request.id not in self.served:
+            self.buffer.append(o)
+        return segments
+    
+    def close(self) -> Dict[int, Tuple[Satellite, float]]:
+        # end of the stream: plan and commit everything left
+        segment = self._close(float('inf'))
+        self.buffer = []
+        return segment
+    
+    def _close(self, boundary: float) -> Dict[int, Tuple[Satellite, float]]:
+        # plan the buffer, commit the slots starting before the boundary
+        instrument.count('rolling.windows')
+        if not self.buffer:
+            return {}
+        with instrument.phase('rolling.window'):
+            order = sorted(range(len(self.buffer)), key=lambda i: (self.buffer[i].p, self.buffer[i].t_start, i))
+            planned = set()
+            for i in order:
+                o = self.buffer[i]
+                timeline = self.R[o.s.id]
+                if o.request.id in planned or self.committed[o.s.id] + len(timeline) >= o.s.capacity:
+                    continue
+                # the slots before the window start are committed
+                slot = timeline.find_slot(o, self.start)
+                if slot is not None:
+                    timeline.insert(slot[0], o, slot[1])
+                    planned.add(o.request.id)
+            
+            segment = {}
+            for satid, timeline in self.R.items():
+                # the first entry may be the last committed observation of the previous windows
+                kept = self.kept[satid]
+                while len(timeline) > kept and timeline[-1][1][1] >= boundary:
+                    timeline.pop(len(timeline) - 1)
+                if len(timeline) == kept:
+                    continue
+                for o, (s, start) in timeline.entries[kept:]:
+                    segment[o.id] = (s, start)
+                    self.served[o.request.id] = max(x.t_start for x in o.request.theta)
+                    self.reward += o.rho
+                self.committed[satid] += len(timeline) - 1
+                self.R[satid] = Timeline(timeline.satellite, [timeline[-1]])
+                self.kept[satid] = 1
+        
+        # keep the observations that can still start after the boundary, and the requests that can still get an opportunity
+        self.buffer = [o for o in self.buffer if o.request.id not in self.served and o.t_end - o.delta >= boundary]
+        self.served = {reqid: last for reqid, last in self.served.items() if last >= self.now}
+        return segment
+
+
+def plan_stream(satellites: List[Satellite], observations: Iterable[Observation], window: float, overlap: float = 0.0) -> Iterator[
+    Dict[int, Tuple[Satellite, float]]]:
+    """
+    Plan a stream of observations ordered by start time, e.g. read from a file or generated lazily, with a RollingHorizonPlanner.
+    :return: A generator of the schedule segments {obs_id: (satellite, start_time)}, one per closed window.
+    """
+    planner = RollingHorizonPlanner(satellites, window, overlap)
+    for o in observations:
+        yield from planner.push(o)
+    yield planner.close()
+    instrument.report('rolling', planner.reward)
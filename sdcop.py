@@ -1,29 +1,41 @@
-import json
-import subprocess
 from collections import defaultdict
-from copy import deepcopy
-from typing import Dict, List, Set, Tuple
-
-import yaml
+from typing import Dict, List, Set, Tuple, Union
 
+import instrument
+from dcop_backend import DcopBackend, DcopModel, get_backend, run_pydcop, write_yaml
 from eoscsp import EOSCSP, Observation, Request, Satellite
 from greedy import first_slot, greedy_eoscsp_solver
+from intervals import ExclusiveIndex
+from session import SolveSession
+from timeline import Timeline
 from utils import generate_random_esop_instance
 
 
-def s_dcop(p: EOSCSP):
+def s_dcop(p: EOSCSP, backend: Union[str, DcopBackend] = 'native', batch: bool = True, max_batch: int = None, workers: int = 1,
+           session: SolveSession = None):
+    """
+    S-DCOP solver for the EOSCSP.
+    :param p: An instance of EOSCSP.
+    :param backend: The solver of the per-request DCOPs, a DcopBackend or one of 'native' (in-process), 'pydcop' (persistent pydcop
+    worker) and 'file' (YAML files and a pydcop subprocess per request).
+    :param batch: Solve the consecutive requests that do not share a satellite in a single DCOP.
+    :param max_batch: The maximum number of requests in a batch.
+    :param workers: The number of processes solving the exclusive users' sub problems, see solve_exclusive_users.
+    :param session: A SolveSession of p, to reuse the exclusive users' plans computed by another solver.
+    :return: A mapping from each observation to (satellite, start_time), and the total reward.
+    """
+    backend = get_backend(backend)
+    session = session or SolveSession(p, workers)
     user_solutions = {user.id: [] for user in p.users}
     # dict[userid] = dict[satid] = [(obs, (sat, start_time))
     rs = dict()
     processed_requests = set()
     
     # slove P[u] for each exclusive user
+    user_plans = session.user_plans()
     for user in p.users:
         if user.exclusive_times:
-            # create a sub problem P[u] only has request and observations of user u
-            sub_p = EOSCSP(satellites=p.satellites, users=p.users, requests=[r for r in p.requests if r.u == user],
-                           observations=[o for o in p.observations if o.u == user])
-            plans, r,_ = greedy_eoscsp_solver(sub_p)
+            plans, r, _ = user_plans[user.id]
             user_solution = [x for value in r.values() for x in value]
             user_solutions[user.id] = user_solution
             rs[user.id] = r
@@ -36,105 +48,130 @@ def s_dcop(p: EOSCSP):
     
     R_ex = defaultdict(list)
     
-    for request in sort_r:
-        generate_dcop_yaml(p, request, user_solutions, rs)
-        
-        dcop_solution = solve_dcop()
-        
-        # print(dcop_solution)
-        
-        for varname, v in dcop_solution.items():
-            if v == 1:
-                userid, satid, obsid = varname.split('_')[1:]
-                user_solutions[int(userid)].append(
-                    (p.observations[int(obsid)], (p.satellites[int(satid)], p.observations[int(obsid)].t_start)))
-                R_ex[int(satid)].append((p.observations[int(obsid)], (p.satellites[int(satid)], p.observations[int(obsid)].t_start)))
-    # slove P[u_0] for non-exclusive user
-    remaining_requests = [req for req in p.requests if req.id not in processed_requests]
-    obs = [obs for req in remaining_requests for obs in req.theta]
-    p_u0 = EOSCSP(satellites=p.satellites, users=[p.users[0]], requests=remaining_requests, observations=obs)
-    _, r,_ = greedy_eoscsp_solver(p_u0, R_ex)
+    index = ExclusiveIndex(p.users)
+    # remaining capacity of each satellite, updated as the DCOP assignments are applied
+    capacity = {s.id: s.capacity for s in p.satellites}
+    for user_solution in user_solutions.values():
+        for obs, _ in user_solution:
+            capacity[obs.s.id] -= 1
+    batches = batch_requests(p, sort_r, max_batch, index) if batch else [[request] for request in sort_r]
+    with backend:
+        for requests in batches:
+            with instrument.phase('sdcop.model'):
+                model = build_dcop_model(p, requests, user_solutions, rs, capacity, index)
+            with instrument.phase('sdcop.solve'):
+                dcop_solution = backend.solve(model)
+            instrument.count('dcop.solves')
+            
+            for varname, v in dcop_solution.items():
+                if v == 1:
+                    userid, satid, obsid = varname.split('_')[1:]
+                    o = p.observation(int(obsid))
+                    user_solutions[int(userid)].append((o, (p.satellite(int(satid)), o.t_start)))
+                    R_ex[int(satid)].append((o, (p.satellite(int(satid)), o.t_start)))
+                    capacity[o.s.id] -= 1
+    with instrument.phase('sdcop.p_u0'):
+        # slove P[u_0] for non-exclusive user
+        remaining_requests = [req for req in p.requests if req.id not in processed_requests]
+        obs = [obs for req in remaining_requests for obs in req.theta]
+        p_u0 = EOSCSP(satellites=p.satellites, users=[p.users[0]], requests=remaining_requests, observations=obs)
+        _, r,_ = greedy_eoscsp_solver(p_u0, R_ex)
     M = [x for value in r.values() for x in value]
     total_reward = sum([o.rho for o, _ in M])
-    print("Reward of sdcop: ", total_reward)
+    instrument.report('sdcop', total_reward)
     final_solution = {}
     for observation, (satellite, start_time) in M:
         final_solution[observation.id] = (satellite, start_time)
     return final_solution, total_reward
 
 
-def generate_dcop_yaml(p: EOSCSP,
-                       request: Request,
-                       user_solutions: Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]],
-                       rs: Dict[int, Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]]]):
-    dcop_data = {'name': 'EOSCSP', 'objective': 'max', 'domains': {'binary_decision': {'values': [0, 1]}}, 'variables': {}, 'agents': {},
-                 'constraints': {}}
-    
-    observations = request.theta
+def find_agents(p: EOSCSP, request: Request, index: ExclusiveIndex = None) -> Set[Tuple[int, int, int]]:
+    # (user, satellite, observation) for each exclusive user whose window overlaps an observation of the request
+    if index is None:
+        index = ExclusiveIndex(p.users)
     agents = set()
-    for o in observations:
-        t_start = o.t_start
-        t_end = o.t_end
-        for user in p.users:
-            if user.exclusive_times:
-                for sat, (start, end) in user.exclusive_times:
-                    if sat.id == o.s.id:
-                        if not (start >= t_end or end <= t_start):
-                            agents.add((user.id, sat.id, o.id))
-    
-    # Generate agents based on exclusive users
-    user_list = [userid for userid, satid, obsid in agents]
-    user_list = set(user_list)
-    agent_list = [f'u_{userid}' for userid in user_list]
-    dcop_data['agents'] = agent_list
+    for o in request.theta:
+        for userid in index.owners(o.s.id, o.t_start, o.t_end):
+            agents.add((userid, o.s.id, o.id))
+    return agents
+
+
+def batch_requests(p: EOSCSP, requests: List[Request], max_batch: int = None, index: ExclusiveIndex = None) -> List[List[Request]]:
+    """
+    Split the ordered requests into consecutive batches whose DCOPs do not interact: the requests of a batch have no satellite in
+    common, so they share no capacity constraint and solving them in one DCOP gives the same result as solving them in sequence.
+    """
+    if index is None:
+        index = ExclusiveIndex(p.users)
+    batches = []
+    batch, batch_satellites = [], set()
+    for request in requests:
+        satellites = {satid for _, satid, _ in find_agents(p, request, index)}
+        if batch and (satellites & batch_satellites or (max_batch and len(batch) >= max_batch)):
+            batches.append(batch)
+            batch, batch_satellites = [], set()
+        batch.append(request)
+        batch_satellites |= satellites
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def build_dcop_model(p: EOSCSP,
+                     requests: List[Request],
+                     user_solutions: Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]],
+                     rs: Dict[int, Dict[int, Timeline]],
+                     capacity: Dict[int, int] = None,
+                     index: ExclusiveIndex = None) -> DcopModel:
+    """
+    Build the DCOP of a batch of requests.
+    :param capacity: The remaining capacity of each satellite, recomputed from user_solutions when not given.
+    :param index: The ExclusiveIndex of p.users, built when not given.
+    """
+    if index is None:
+        index = ExclusiveIndex(p.users)
+    agents = set()
+    for request in requests:
+        agents |= find_agents(p, request, index)
     
-    # Generate variables and constraints for each request and observation
-    variables_list = []
+    # Generate a variable for each exclusive user that can take an observation
+    model = DcopModel()
     obs_group = defaultdict(list)
     sat_group = defaultdict(list)
-    for userid, satid, obsid in agents:
-        var_name = f'x_{userid}_{satid}_{obsid}'
-        variables_list.append(var_name)
-        dcop_data['variables'][var_name] = {'domain': 'binary_decision'}
+    for userid, satid, obsid in sorted(agents):
+        var_name = model.add_variable(userid, satid, obsid, calculate_reward(p.observation(obsid), rs[userid]))
         obs_group[obsid].append(var_name)
         sat_group[satid].append(var_name)
     
     # Generate constraints for each observation
     for obsid, var_list in obs_group.items():
-        constraint_name = f'one_obs_{obsid}'
-        dcop_data['constraints'][constraint_name] = {'type': 'intention', 'function': f'100 if sum([{", ".join(var_list)}]) <= 1 else 0'}
+        model.add_constraint(f'one_obs_{obsid}', var_list, 1)
     
     # Generate constraints for each satellite capacity
     for satid, var_list in sat_group.items():
-        constraint_name = f'capacity_{satid}'
-        remaine_capacity = calculate_capacity(p, satid, user_solutions)
-        dcop_data['constraints'][constraint_name] = {'type': 'intention',
-                                                     'function': f'100 if sum([{", ".join(var_list)}]) <= {remaine_capacity} else 0'}
-    
-    cost_function = build_cost_function(p, agents, rs)
-    dcop_data['constraints']['cost'] = {'type': 'intention', 'function': cost_function}
+        remaining = capacity[satid] if capacity is not None else calculate_capacity(p, satid, user_solutions)
+        model.add_constraint(f'capacity_{satid}', var_list, remaining)
     
-    # distribute the variables to agents
-    distribution = {}
-    for variables in variables_list:
-        userid = variables.split('_')[1]
-        if f'u_{userid}' not in distribution:
-            distribution[f'u_{userid}'] = []
-        distribution[f'u_{userid}'].append(variables)
+    return model
+
+
+def generate_dcop_yaml(p: EOSCSP,
+                       request: Request,
+                       user_solutions: Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]],
+                       rs: Dict[int, Dict[int, Timeline]]):
+    dcop_data, distribution = build_dcop_model(p, [request], user_solutions, rs).to_yaml()
     
-    with open('distribution.yaml', 'w') as file:
-        yaml.dump({'distribution': distribution}, file, default_flow_style=False)
+    write_yaml('distribution.yaml', {'distribution': distribution})
     
     # Serialize to YAML
-    with open('dcop.yaml', 'w') as file:
-        yaml.dump(dcop_data, file, default_flow_style=False)
+    write_yaml('dcop.yaml', dcop_data)
     
     return dcop_data, distribution
 
 
 def calculate_capacity(p: EOSCSP, satid: int, user_solutions: Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]]):
     # calculate the remaining capacity of a satellite
-    capacity = p.satellites[satid].capacity
+    capacity = p.satellite(satid).capacity
     for user in user_solutions:
         for obs, _ in user_solutions[user]:
             if obs.s.id == satid:
@@ -143,35 +180,15 @@ def calculate_capacity(p: EOSCSP, satid: int, user_solutions: Dict[int, List[Tup
     return capacity
 
 
-def build_cost_function(p: EOSCSP,
-                        agents: Set[Tuple[int, int, int]],
-                        rs: Dict[int, Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]]]):
-    cost_function = []
-    for userid, satid, obsid in agents:
-        var_name = f'x_{userid}_{satid}_{obsid}'
-        reward = calculate_reward(p.observations[obsid], rs[userid])
-        cost_function.append(f'{var_name} * {reward}')
-    return f'sum([{", ".join(cost_function)}])'
-
-
-def calculate_reward(o: Observation, r: Dict[int, List[Tuple[Observation, Tuple[Satellite, float]]]]):
-    if first_slot(o, deepcopy(r)):
+def calculate_reward(o: Observation, r: Dict[int, Timeline]):
+    if first_slot(o, r, probe=True):
         return o.rho
     return 0
 
 
 def solve_dcop() -> Dict:
-    try:
-        command = f"pydcop solve --algo dpop dcop.yaml -d distribution.yaml"
-        process = subprocess.Popen(["/bin/bash", "-c", command], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-        
-        output = stdout.decode()
-        result = json.loads(output)
-        assignment = result.get("assignment", {})
-        return assignment
-    except:
-        return False
+    # solve dcop.yaml and distribution.yaml written by generate_dcop_yaml
+    return run_pydcop('dcop.yaml', 'distribution.yaml')
 
 
 def integrate_solutions(eoscsp, user_solutions):
@@ -0,0 +1,54 @@
+from typing import Dict, List, Tuple
+
+from eoscsp import EOSCSP, Observation, Request, Satellite, User
+from exclusive import group_by_user, solve_exclusive_users
+from timeline import Timeline, copy_plan
+
+
+class SolveSession:
+    """
+    The work shared by the solvers on one EOSCSP instance, computed once and handed out as independent copies: the greedy plan
+    of each exclusive user, the requests and observations of each user and the non-exclusive requests.
+    Pass the same session to `s_dcop`, `psi_solver` and `ssi_solver` to compare them without solving the exclusive users'
+    sub problems again. The instance must not be modified while the session is in use, or `clear` must be called.
+    :param p: An instance of EOSCSP.
+    :param workers: The number of processes solving the exclusive users' sub problems, see solve_exclusive_users.
+    """
+    
+    def __init__(self, p: EOSCSP, workers: int = 1):
+        self.p = p
+        self.workers = workers
+        self.clear()
+    
+    def clear(self):
+        self._user_plans = None
+        self._requests = None
+        self._observations = None
+        self._non_exclusive = None
+    
+    def _group(self):
+        self._requests, self._observations = group_by_user(self.p)
+    
+    def requests_of(self, user: User) -> List[Request]:
+        if self._requests is None:
+            self._group()
+        return list(self._requests[user.id])
+    
+    def observations_of(self, user: User) -> List[Observation]:
+        if self._observations is None:
+            self._group()
+        return list(self._observations[user.id])
+    
+    def non_exclusive_requests(self) -> List[Request]:
+        # requests of the users without exclusive windows, sorted by end time
+        if self._non_exclusive is None:
+            self._non_exclusive = sorted([r for r in self.p.requests if not r.u.exclusive_times], key=lambda r: r.t_end)
+        return list(self._non_exclusive)
+    
+    def user_plans(self) -> Dict[int, Tuple[Dict[int, Tuple[Satellite, float]], Dict[int, Timeline], float]]:
+        # the greedy (m, r, total_reward) of each exclusive user, the caller may modify the returned plans
+        if self._user_plans is None:
+            if self._requests is None:
+                self._group()
+            self._user_plans = solve_exclusive_users(self.p, self.workers, (self._requests, self._observations))
+        return {userid: (dict(m), copy_plan(r), reward) for userid, (m, r, reward) in self._user_plans.items()}
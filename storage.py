@@ -0,0 +1,67 @@
+import json
+import os
+from dataclasses import fields
+from typing import Dict, Tuple, Union
+
+import numpy as np
+
+from columnar import ColumnarEOSCSP, ID
+from eoscsp import EOSCSP, Satellite
+
+FORMAT_VERSION = 1
+
+SCHEDULE_DTYPE = np.dtype([('obs', ID), ('sat', ID), ('start', float)])
+
+
+def save_instance(p: Union[EOSCSP, ColumnarEOSCSP], path: str):
+    """
+    Save an instance in the binary format: a directory holding one `.npy` file per column of its ColumnarEOSCSP (objects refer to
+    each other by id) and a `meta.json` describing them.
+    """
+    if isinstance(p, EOSCSP):
+        p = ColumnarEOSCSP.from_eoscsp(p)
+    os.makedirs(path, exist_ok=True)
+    columns = {}
+    for f in fields(ColumnarEOSCSP):
+        column = np.ascontiguousarray(getattr(p, f.name))
+        np.save(os.path.join(path, f'{f.name}.npy'), column)
+        columns[f.name] = {'dtype': column.dtype.str, 'length': len(column)}
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump({'format': 'eoscsp', 'version': FORMAT_VERSION, 'columns': columns}, file, indent=1)
+
+
+def load_instance(path: str, mmap: bool = True, columnar: bool = True) -> Union[ColumnarEOSCSP, EOSCSP]:
+    """
+    Load an instance saved by save_instance.
+    :param mmap: Map the columns read-only with numpy.memmap instead of reading them, so that opening is immediate and the pages
+    are shared between the processes loading the same instance.
+    :param columnar: Return the ColumnarEOSCSP, or convert it to the object model.
+    """
+    with open(os.path.join(path, 'meta.json')) as file:
+        meta = json.load(file)
+    if meta.get('format') != 'eoscsp' or meta.get('version') != FORMAT_VERSION:
+        raise ValueError(f'{path} is not an EOSCSP instance of version {FORMAT_VERSION}')
+    mmap_mode = 'r' if mmap else None
+    p = ColumnarEOSCSP(**{name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in meta['columns']})
+    return p if columnar else p.to_eoscsp()
+
+
+def save_schedule(schedule: Dict[int, Tuple[Satellite, float]], path: str):
+    # {obs_id: (satellite, start)} as a single .npy file of (obs, sat, start) records
+    records = np.empty(len(schedule), dtype=SCHEDULE_DTYPE)
+    records['obs'] = list(schedule)
+    records['sat'] = [s.id for s, _ in schedule.values()]
+    records['start'] = [start for _, start in schedule.values()]
+    np.save(path, records)
+
+
+def load_schedule(path: str, p: EOSCSP = None, mmap: bool = True) -> Union[np.ndarray, Dict[int, Tuple[Satellite, float]]]:
+    """
+    Load a schedule saved by save_schedule.
+    :param p: The instance of the schedule, to get back the {obs_id: (satellite, start)} mapping. Without it the (obs, sat, start)
+    records are returned as they are.
+    """
+    records = np.load(path, mmap_mode='r' if mmap else None)
+    if p is None:
+        return records
+    return {int(obsid): (p.satellite(int(satid)), float(start)) for obsid, satid, start in records}
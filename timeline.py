@@ -0,0 +1,156 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import instrument
+from eoscsp import Observation, Satellite
+
+
+class Timeline:
+    r"""
+    The plan of a single satellite: the scheduled observations ordered by start time.
+    Alongside the entries, two parallel sorted lists are kept so that a free slot can be found with a binary search instead of a
+    linear scan over the whole plan:
+    :param starts: The start time of each scheduled observation.
+    :param free_after: The earliest start time of the observation following each entry, i.e. :math:`t + \delta_o + \tau_s`.
+    """
+    __slots__ = ('satellite', 'entries', 'starts', 'free_after')
+    
+    def __init__(self, satellite: Satellite, entries: Iterable[Tuple[Observation, Tuple[Satellite, float]]] = ()):
+        self.satellite = satellite
+        self.entries: List[Tuple[Observation, Tuple[Satellite, float]]] = []
+        self.starts: List[float] = []
+        self.free_after: List[float] = []
+        for observation, (_, start) in sorted(entries, key=lambda x: x[1][1]):
+            self.insert(len(self.entries), observation, start)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __iter__(self) -> Iterator[Tuple[Observation, Tuple[Satellite, float]]]:
+        return iter(self.entries)
+    
+    def __getitem__(self, i):
+        return self.entries[i]
+    
+    def __repr__(self):
+        return f'Timeline(satellite={self.satellite.id}, entries={[(o.id, t) for o, (_, t) in self.entries]})'
+    
+    def copy(self) -> 'Timeline':
+        timeline = Timeline(self.satellite)
+        timeline.entries = list(self.entries)
+        timeline.starts = list(self.starts)
+        timeline.free_after = list(self.free_after)
+        return timeline
+    
+    def find_slot(self, observation: Observation, after: float = None) -> Optional[Tuple[int, float]]:
+        """
+        Find the earliest position where the observation fits, without modifying the plan.
+        The semantics are those of the linear scan of the original `first_slot`: the observation is placed in the first gap (in
+        time order) where it can start after the previous observation plus the transition time, and end, plus the transition time,
+        before the next one starts.
+        :param after: The earliest start time allowed, later than the start of the observation's window.
+        :return: The insertion index and start time, or None if the observation cannot be scheduled.
+        """
+        s = self.satellite
+        t_start = observation.t_start if after is None else max(observation.t_start, after)
+        starts = self.starts
+        n = len(starts)
+        if n >= s.capacity:
+            return None
+        if n == 0:
+            if observation.t_end >= t_start + observation.delta:
+                return 0, t_start
+            return None
+        
+        # gaps whose next observation starts before t_start + delta + tau can never fit the observation, and gaps after an
+        # observation starting past t_end cannot either
+        lo = bisect_left(starts, t_start + observation.delta + s.transition_time)
+        hi = min(n, bisect_right(starts, observation.t_end))
+        for i in range(lo, hi + 1):
+            t_start_prime = t_start
+            if i > 0:
+                t_start_prime = max(t_start, self.free_after[i - 1])
+            if t_start_prime + observation.delta <= observation.t_end:
+                if i == n:
+                    t_upper = observation.t_end
+                    t_end_prime = t_start_prime + observation.delta
+                else:
+                    t_upper = starts[i]
+                    t_end_prime = t_start_prime + observation.delta + s.transition_time
+                if t_start_prime < t_end_prime <= t_upper:
+                    return i, t_start_prime
+        return None
+    
+    def insert(self, i: int, observation: Observation, start: float):
+        self.entries.insert(i, (observation, (self.satellite, start)))
+        self.starts.insert(i, start)
+        self.free_after.insert(i, start + observation.delta + self.satellite.transition_time)
+    
+    def add(self, observation: Observation, start: float):
+        # insert at the position given by the start time
+        self.insert(bisect_right(self.starts, start), observation, start)
+    
+    def index(self, observation: Observation, start: float) -> int:
+        # position of a scheduled observation, the entries starting at the same time are checked by identity
+        i = bisect_left(self.starts, start)
+        while self.entries[i][0] is not observation:
+            i += 1
+        return i
+    
+    def remove(self, observation: Observation, start: float):
+        self.pop(self.index(observation, start))
+    
+    def pop(self, i: int) -> Tuple[Observation, Tuple[Satellite, float]]:
+        del self.starts[i]
+        del self.free_after[i]
+        return self.entries.pop(i)
+
+
+class UndoLog:
+    """
+    Records the changes made to a plan so that a trial can be rolled back instead of working on a deep copy of the plan.
+    Changes are undone in reverse order, so the recorded indices stay valid.
+    """
+    __slots__ = ('changes',)
+    
+    def __init__(self):
+        # (timeline, index, removed entry or None for an insertion)
+        self.changes: List[Tuple[Timeline, int, Optional[Tuple[Observation, Tuple[Satellite, float]]]]] = []
+    
+    def record(self, timeline: Timeline, i: int):
+        self.changes.append((timeline, i, None))
+    
+    def record_removal(self, timeline: Timeline, i: int, entry: Tuple[Observation, Tuple[Satellite, float]]):
+        self.changes.append((timeline, i, entry))
+    
+    def checkpoint(self) -> int:
+        return len(self.changes)
+    
+    def rollback(self, checkpoint: int = 0):
+        while len(self.changes) > checkpoint:
+            timeline, i, entry = self.changes.pop()
+            if entry is None:
+                timeline.pop(i)
+            else:
+                observation, (_, start) = entry
+                timeline.insert(i, observation, start)
+
+
+def make_plan(satellites: List[Satellite], r: Dict[int, Iterable[Tuple[Observation, Tuple[Satellite, float]]]] = None) -> Dict[
+    int, Timeline]:
+    """
+    Build the per-satellite plan `R[s.id]` used by the solvers.
+    Timelines already present in `r` are kept as they are (and will be modified in place), plain lists of `(o, (s, t_start))` are
+    converted.
+    """
+    plan = {}
+    for s in satellites:
+        entries = r.get(s.id, ()) if r is not None else ()
+        plan[s.id] = entries if isinstance(entries, Timeline) else Timeline(s, entries)
+    return plan
+
+
+def copy_plan(r: Dict[int, Timeline]) -> Dict[int, Timeline]:
+    # independent copy of a plan, the observations themselves are shared
+    instrument.count('plan_copies')
+    return {satid: timeline.copy() for satid, timeline in r.items()}
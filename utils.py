@@ -2,6 +2,9 @@ import random
 
 from math import ceil
 
+import numpy as np
+
+from columnar import ColumnarEOSCSP, ID
 from eoscsp import EOSCSP, Observation, Request, Satellite, User, reset_counters
 
 OBSERVATION_PER_REQUEST = 5
@@ -97,6 +100,91 @@ def generate_random_esop_instance(num_satellites, num_exclusive_users, num_reque
     return EOSCSP(satellites=satellites, users=users, requests=requests, observations=observations)
 
 
+def generate_exclusive_windows(rng: np.random.Generator, start, end, num_windows: np.ndarray, minimum_duration=1):
+    # non-overlapping windows of at least minimum_duration inside [start, end] for each satellite, the j-th window of a satellite
+    # is [u_2j + j * minimum_duration, u_2j+1 + (j + 1) * minimum_duration] over 2k sorted uniform draws u in the free time
+    free = (end - start) - num_windows * minimum_duration
+    if np.any(free < 0):
+        raise ValueError(f'cannot fit {num_windows.max()} exclusive windows of {minimum_duration} in [{start}, {end}]')
+    window_sat = np.repeat(np.arange(len(num_windows)), num_windows)
+    draws = rng.uniform(0, 1, 2 * len(window_sat)) * np.repeat(free, 2 * num_windows)
+    draws = draws[np.lexsort((draws, np.repeat(window_sat, 2)))].reshape(-1, 2)
+    rank = np.arange(len(window_sat)) - np.repeat(np.cumsum(num_windows) - num_windows, num_windows)
+    t_start = start + draws[:, 0] + rank * minimum_duration
+    t_end = start + draws[:, 1] + (rank + 1) * minimum_duration
+    return window_sat, t_start, t_end
+
+
+def generate_columnar_instance(num_satellites, num_exclusive_users, num_requests, seed=None, start_time=2, end_time=20):
+    """
+    Vectorized counterpart of generate_random_esop_instance: every draw is a batched NumPy call on a Generator seeded with
+    `seed`, so the same seed gives the same instance in any process. Ids are the row indices of each table.
+    As in generate_random_esop_instance, satellite 0 holds one exclusive window per exclusive user, every other satellite
+    between 1 and ceil(num_exclusive_users / 2) windows of random exclusive users, and the windows of a satellite do not overlap.
+    """
+    rng = np.random.default_rng(seed)
+    num_users = num_exclusive_users + 1  # Including central scheduler
+    
+    capacity = rng.integers(4, 10, num_satellites, endpoint=True)
+    user_p = rng.integers(1, 10, num_users, endpoint=True)
+    
+    num_windows = np.zeros(num_satellites, dtype=int)
+    if num_exclusive_users:
+        num_windows = rng.integers(1, ceil(num_exclusive_users / 2), num_satellites, endpoint=True)
+        num_windows[0] = num_exclusive_users
+    excl_sat, excl_start, excl_end = generate_exclusive_windows(rng, start_time, end_time, num_windows)
+    excl_user = rng.integers(1, num_users, len(excl_sat))
+    if num_exclusive_users:
+        excl_user[:num_exclusive_users] = rng.permutation(np.arange(1, num_users))
+    
+    # windows grouped by user, to draw a window of the requester
+    by_user = np.argsort(excl_user, kind='stable')
+    user_windows = np.bincount(excl_user, minlength=num_users)
+    user_first = np.cumsum(user_windows) - user_windows
+    
+    req_user = rng.integers(0, num_users, num_requests)
+    # requests of users with exclusive windows are generated within one of their windows, the others over the whole horizon
+    exclusive = np.flatnonzero(user_windows[req_user] > 0)
+    window = by_user[user_first[req_user[exclusive]] + (rng.uniform(0, 1, len(exclusive)) * user_windows[req_user[exclusive]]).astype(int)]
+    lo = np.full(num_requests, float(start_time))
+    hi = np.full(num_requests, float(end_time))
+    lo[exclusive] = excl_start[window]
+    hi[exclusive] = excl_end[window]
+    
+    req_t_start = rng.uniform(lo, hi - 1)
+    req_t_end = rng.uniform(req_t_start + 1, hi)
+    req_reward = rng.uniform(10, 100, num_requests)
+    delta = req_t_end - req_t_start
+    
+    # OBSERVATION_PER_REQUEST observations per request, on the satellite of the exclusive window or on any satellite
+    shape = (num_requests, OBSERVATION_PER_REQUEST)
+    obs_lo, obs_hi, obs_delta = lo[:, None], hi[:, None], delta[:, None]
+    t_start = rng.uniform(obs_lo, obs_hi - obs_delta, shape)
+    t_end = rng.uniform(t_start + obs_delta, obs_hi, shape)
+    satellite = rng.integers(0, num_satellites, shape)
+    satellite[exclusive] = excl_sat[window][:, None]
+    
+    def per_observation(values):
+        return np.repeat(values, OBSERVATION_PER_REQUEST)
+    
+    return ColumnarEOSCSP(sat_id=np.arange(num_satellites, dtype=ID), sat_start=np.full(num_satellites, float(start_time)),
+                          sat_end=np.full(num_satellites, float(end_time)), sat_capacity=capacity.astype(ID),
+                          sat_transition=np.full(num_satellites, 0.2), user_id=np.arange(num_users, dtype=ID), user_p=user_p.astype(ID),
+                          excl_user=excl_user.astype(ID), excl_sat=excl_sat.astype(ID), excl_start=excl_start, excl_end=excl_end,
+                          req_id=np.arange(num_requests, dtype=ID), req_t_start=req_t_start, req_t_end=req_t_end, req_reward=req_reward,
+                          req_user=req_user.astype(ID), obs_id=np.arange(num_requests * OBSERVATION_PER_REQUEST, dtype=ID),
+                          obs_i=np.tile(np.arange(OBSERVATION_PER_REQUEST, dtype=ID), num_requests), t_start=t_start.ravel(),
+                          t_end=t_end.ravel(), delta=per_observation(delta), rho=per_observation(req_reward),
+                          priority=per_observation(user_p[req_user]).astype(ID), satellite=satellite.ravel().astype(ID),
+                          user=per_observation(req_user).astype(ID), request=per_observation(np.arange(num_requests)).astype(ID))
+
+
+def generate_large_instance(num_satellites, num_exclusive_users, num_requests, seed=None, columnar=False, start_time=2, end_time=20):
+    # seedable, vectorized instance generator, returning the object model or the ColumnarEOSCSP
+    p = generate_columnar_instance(num_satellites, num_exclusive_users, num_requests, seed, start_time, end_time)
+    return p if columnar else p.to_eoscsp()
+
+
 if __name__ == '__main__':
     esop_instance = generate_random_esop_instance(3, 2, 5)
     esop_instance.plot_schedule()